@@ -2,8 +2,39 @@ import textwrap
 import time
 import json
 import csv
+import sqlite3
+import os
+import stat
+import sys
+import math
+import random
+import hashlib
+import gzip
+import mmap
+import socket
+import struct
 import requests
 import argparse
+import asyncio
+import queue
+import threading
+import http.server
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from http.cookiejar import DefaultCookiePolicy
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode, quote
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import NameResolutionError, NewConnectionError, ConnectTimeoutError
+from urllib3.util.connection import allowed_gai_family
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
 
 logo = """
    __  __     __   _____             
@@ -102,85 +133,999 @@ STATUS_CODES = {
 }
 
 
+# Order in which methods are probed and reported
+METHODS = ['GET', 'POST', 'PUT', 'HEAD', 'DELETE', 'OPTIONS', 'PATCH']
+
+
+# Keeps the first `limit` bytes of a body fed to it chunk by chunk and works
+# out the full size without holding the rest. The size is Content-Length when
+# the body is not content-encoded, otherwise the bytes counted while draining
+# up to `drain_limit` bytes past the limit. A short remainder is drained so
+# the connection can go back to the pool; a longer one is cheaper to close,
+# and the size is then a lower bound. Every byte received is hashed, so the
+# digest covers the whole body; there is none when the body was not read to
+# the end.
+class BodyCapture:
+    chunk_size = 16 * 1024
+
+    def __init__(self, limit, drain_limit, headers):
+        self.limit = limit
+        self.drain_limit = drain_limit
+        self.chunks = []
+        self.captured = 0
+        self.received = 0
+        self.complete = False
+        self.hash = body_hasher()
+        self.declared = None
+        if not headers.get('Content-Encoding'):
+            try:
+                self.declared = int(headers.get('Content-Length'))
+            except (TypeError, ValueError):
+                pass
+
+    # Returns False once the rest of the body is not worth reading
+    def feed(self, chunk):
+        if self.captured < self.limit:
+            keep = chunk[:self.limit - self.captured]
+            self.chunks.append(keep)
+            self.captured += len(keep)
+        self.received += len(chunk)
+        self.hash.update(chunk)
+
+        if self.received < self.limit:
+            return True
+        if self.declared != None:
+            return self.received >= self.declared or self.declared - self.limit <= self.drain_limit
+        return self.received - self.limit <= self.drain_limit
+
+    @property
+    def content(self):
+        return b''.join(self.chunks)
+
+    @property
+    def size(self):
+        return self.declared if self.declared != None else self.received
+
+    @property
+    def digest(self):
+        return self.hash.digest() if self.complete else None
+
+
+# Phases of a probe that are timed, in the order they happen
+PHASES = ['DNS', 'Connect', 'TLS', 'TTFB', 'Body']
+
+# Seconds spent in each phase of one probe. DNS, Connect and TLS are only
+# timed when a new connection is opened (a reused keep-alive connection skips
+# them) and add up over redirects. TTFB is the wait for the response headers
+# once connected, Body the time taken to read the body after them.
+class PhaseTimer:
+    def __init__(self):
+        self.spent = {}
+        self.started = time.perf_counter()
+        self.headers_at = None
+
+    def add(self, phase, seconds):
+        self.spent[phase] = self.spent.get(phase, 0.0) + seconds
+
+    # Seconds spent setting up connections so far
+    def connecting(self):
+        return sum(self.spent.get(p, 0.0) for p in ('DNS', 'Connect', 'TLS'))
+
+    def headers_received(self):
+        self.headers_at = time.perf_counter()
+        self.add('TTFB', max(0.0, self.headers_at - self.started - self.connecting()))
+
+    def body_read(self):
+        if self.headers_at != None:
+            self.add('Body', time.perf_counter() - self.headers_at)
+
+    # One value per PHASES entry, None for phases that did not happen
+    def timings(self):
+        return tuple(self.spent.get(p) for p in PHASES)
+
+
+# Seconds a probe took from the moment it was sent: its timed phases add up
+# to that. Rate limit waits, retries and queueing for a slot are not in it.
+# None when nothing was timed.
+def request_seconds(result):
+    if result.timings == None:
+        return None
+    return sum(t for t in result.timings if t != None)
+
+
+# The PhaseTimer of the probe running on the current thread. urllib3 opens
+# connections on the thread that sends the request, so the connection classes
+# below can find the probe they are timing here.
+_phase_clock = threading.local()
+
+def current_phase_timer():
+    return getattr(_phase_clock, 'timer', None)
+
+
+# urllib3 connection that times name resolution and the TCP connect
+# separately: it resolves the host itself and connects to each address in turn
+# the way urllib3 would.
+class TimedHTTPConnection(HTTPConnection):
+    def _new_conn(self):
+        timer = current_phase_timer()
+        if timer == None:
+            return super()._new_conn()
+
+        start = time.perf_counter()
+        try:
+            addresses = socket.getaddrinfo(
+                self._dns_host.strip('[]'), self.port, allowed_gai_family(), socket.SOCK_STREAM)
+        except socket.gaierror as err:
+            raise NameResolutionError(self.host, self, err) from err
+        finally:
+            resolved = time.perf_counter()
+            timer.add('DNS', resolved - start)
+
+        dns_host = self._dns_host
+        try:
+            for i, address in enumerate(addresses):
+                self._dns_host = address[4][0]
+                try:
+                    return super()._new_conn()
+                except (NewConnectionError, ConnectTimeoutError):
+                    if i == len(addresses) - 1:
+                        raise
+        finally:
+            self._dns_host = dns_host
+            timer.add('Connect', time.perf_counter() - resolved)
+
+class TimedHTTPSConnection(TimedHTTPConnection, HTTPSConnection):
+    # TLS is whatever connect() spends on top of resolving and connecting
+    def connect(self):
+        timer = current_phase_timer()
+        if timer == None:
+            return super().connect()
+
+        start = time.perf_counter()
+        before = timer.connecting()
+        try:
+            super().connect()
+        finally:
+            tls = time.perf_counter() - start - (timer.connecting() - before)
+            timer.add('TLS', max(0.0, tls))
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+TIMED_POOL_CLASSES = {
+    'http': TimedHTTPConnectionPool,
+    'https': TimedHTTPSConnectionPool,
+}
+
+# HTTPAdapter whose connections report phase timings. SOCKS proxies keep
+# urllib3's own connections, so only TTFB and Body are timed through them.
+# It also counts requests sent and connections opened: a pool dropped by its
+# manager (least recently used, past `pool_connections` hosts) is added to
+# running totals on the way out, so no pool is kept alive for the count.
+class TimedHTTPAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        self.retired_requests = 0
+        self.retired_connections = 0
+        self._stats_lock = threading.Lock()
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = TIMED_POOL_CLASSES
+        self._count_pools(self.poolmanager)
+
+    def proxy_manager_for(self, proxy, **proxy_kwargs):
+        new = proxy not in self.proxy_manager
+        manager = super().proxy_manager_for(proxy, **proxy_kwargs)
+        if new:
+            if not proxy.lower().startswith('socks'):
+                manager.pool_classes_by_scheme = TIMED_POOL_CLASSES
+            self._count_pools(manager)
+        return manager
+
+    def _count_pools(self, manager):
+        dispose = manager.pools.dispose_func
+        def retire(pool):
+            with self._stats_lock:
+                self.retired_requests += pool.num_requests
+                self.retired_connections += pool.num_connections
+            # urllib3 2 leaves evicted pools to the garbage collector
+            if dispose != None:
+                dispose(pool)
+        manager.pools.dispose_func = retire
+
+    # (requests sent, connections opened) over every pool used so far
+    def connection_stats(self):
+        sent = opened = 0
+        for manager in [self.poolmanager] + list(self.proxy_manager.values()):
+            for key in list(manager.pools.keys()):
+                pool = manager.pools.get(key)
+                if pool != None:
+                    sent += pool.num_requests
+                    opened += pool.num_connections
+        with self._stats_lock:
+            return sent + self.retired_requests, opened + self.retired_connections
+
+
+# Phase timings summed up over a whole scan: per phase the number of probes
+# it happened in, the mean, percentiles and the max. Percentiles come from a
+# log-scale histogram (buckets 5% wide) so memory stays flat on huge scans.
+class PhaseStats:
+    bucket_ratio = 1.05
+
+    def __init__(self):
+        self.counts = {p: 0 for p in PHASES}
+        self.totals = {p: 0.0 for p in PHASES}
+        self.maxima = {p: 0.0 for p in PHASES}
+        self.buckets = {p: {} for p in PHASES}
+
+    def add(self, scan_results):
+        for result in scan_results.values():
+            timings = result.timings
+            if timings == None:
+                continue
+            for phase, seconds in zip(PHASES, timings):
+                if seconds == None:
+                    continue
+                self.counts[phase] += 1
+                self.totals[phase] += seconds
+                self.maxima[phase] = max(self.maxima[phase], seconds)
+                # Bucketed by microseconds
+                bucket = int(math.log(seconds * 1e6 + 1, self.bucket_ratio))
+                self.buckets[phase][bucket] = self.buckets[phase].get(bucket, 0) + 1
+
+    def mean(self, phase):
+        if not self.counts[phase]:
+            return None
+        return self.totals[phase] / self.counts[phase]
+
+    # Seconds at quantile `q` (0..1) of a phase, accurate to a bucket
+    def percentile(self, phase, q):
+        if not self.counts[phase]:
+            return None
+        rank = q * self.counts[phase]
+        seen = 0
+        for bucket in sorted(self.buckets[phase]):
+            seen += self.buckets[phase][bucket]
+            if seen >= rank:
+                # Middle of the bucket
+                return min(self.maxima[phase], (self.bucket_ratio ** (bucket + 0.5) - 1) / 1e6)
+        return self.maxima[phase]
+
+
+# Short digest identifying a body. 64 bits is plenty to tell the bodies of
+# one scan apart.
+def body_digest(body):
+    return hashlib.blake2b(body, digest_size=8).digest()
+
+# Same digest, worked out a chunk at a time
+def body_hasher():
+    return hashlib.blake2b(digest_size=8)
+
+
+# Bodies by digest, so results with byte-identical bodies (catch-all 404/405
+# pages, WAF block pages) share one bytes object instead of each holding a
+# copy. Only recently seen bodies are kept, up to `max_entries` of them and
+# `max_bytes` in total, so memory stays bounded however many distinct bodies
+# a scan sees; the bodies that repeat stay hot.
+class BodyStore:
+    def __init__(self, max_entries=4096, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()   # digest -> [body, times seen]
+        self.size = 0
+        self.hits = 0
+        self.saved_bytes = 0
+        self._lock = threading.Lock()
+
+    # The stored copy of `body` if one is held, otherwise `body` itself
+    def share(self, digest, body):
+        if not body:
+            return body
+        with self._lock:
+            entry = self.entries.get(digest)
+            if entry != None and len(entry[0]) == len(body):
+                self.entries.move_to_end(digest)
+                entry[1] += 1
+                self.hits += 1
+                self.saved_bytes += len(body)
+                return entry[0]
+
+            if len(body) * 16 > self.max_bytes:
+                return body
+            self.entries[digest] = [body, 1]
+            self.size += len(body)
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                old_body, _ = self.entries.popitem(last=False)[1]
+                self.size -= len(old_body)
+            return body
+
+    # (digest, times seen, size) of the most repeated bodies still held
+    def most_common(self, n=5):
+        with self._lock:
+            entries = [(d, e[1], len(e[0])) for d, e in self.entries.items() if e[1] > 1]
+        entries.sort(key=lambda e: e[1], reverse=True)
+        return entries[:n]
+
+
+# Outcome of one probe. Slotted to keep millions of them small, and the body
+# is kept as the raw bytes received: it is only decoded when
+# response_content is read.
 class EndpointResult:
-    response_content = None
-    request_success = False
-    response_content_type = "Not Specificed"
-    response_size = 0
-    status_code = 0
-    error = None
+    __slots__ = (
+        'response_body',
+        'request_success',
+        'response_content_type',
+        'response_size',
+        'status_code',
+        'error',
+        'packed',
+        'etag',
+        'last_modified',
+    )
+
+    # The body digest and the phase timings share one small bytes object
+    # instead of a digest, a tuple and its floats: a flag byte (which of the
+    # two are set), the 8-byte digest and the timings as float32 seconds, NaN
+    # for a phase that did not happen
+    _packed_format = struct.Struct('<B8s{}f'.format(len(PHASES)))
+    _has_hash = 1
+    _has_timings = 2
+
+    def __init__(self):
+        self.response_body = None
+        self.request_success = False
+        self.response_content_type = "Not Specificed"
+        self.response_size = 0
+        self.status_code = 0
+        self.error = None
+        self.packed = None
+        self.etag = None
+        self.last_modified = None
+
+    def _unpack(self):
+        if self.packed == None:
+            return 0, bytes(8), (math.nan,) * len(PHASES)
+        flags, digest, *times = self._packed_format.unpack(self.packed)
+        return flags, digest, times
+
+    def _pack(self, flags, digest, times):
+        if not flags:
+            self.packed = None
+        else:
+            self.packed = self._packed_format.pack(flags, digest, *times)
+
+    # Digest of the body (see body_digest()), or None
+    @property
+    def body_hash(self):
+        flags, digest, times = self._unpack()
+        return digest if flags & self._has_hash else None
+
+    @body_hash.setter
+    def body_hash(self, value):
+        flags, digest, times = self._unpack()
+        if value == None:
+            self._pack(flags & ~self._has_hash, bytes(8), times)
+        else:
+            self._pack(flags | self._has_hash, value, times)
+
+    # Seconds per PHASES entry (None where a phase did not happen), or None
+    # when the probe was never timed
+    @property
+    def timings(self):
+        flags, digest, times = self._unpack()
+        if not flags & self._has_timings:
+            return None
+        return tuple(None if t != t else t for t in times)
+
+    @timings.setter
+    def timings(self, value):
+        flags, digest, times = self._unpack()
+        if value == None:
+            self._pack(flags & ~self._has_timings, digest, (math.nan,) * len(PHASES))
+        else:
+            self._pack(flags | self._has_timings, digest, [math.nan if t == None else t for t in value])
+
+    @property
+    def response_content(self):
+        if self.response_body == None:
+            return None
+        return self.response_body.decode('utf8','ignore')
+
+    @response_content.setter
+    def response_content(self, value):
+        if isinstance(value, str):
+            value = value.encode('utf8')
+        self.response_body = value
+
+    # The first `max_len` characters of the body (-1 for all of it), decoding
+    # no more bytes than that can take
+    def content_prefix(self, max_len=-1):
+        if self.response_body == None:
+            return None
+        if max_len == -1:
+            return self.response_content
+        # UTF-8 never needs more than 4 bytes per character
+        return self.response_body[:max_len * 4].decode('utf8','ignore')[:max_len]
     
-# If an output location is specified the output will be redirected to a
-# file rather than STDOUT (pretty colors). If a filetype is not specified,
-# the default type JSON will be selected. All options include: JSON, CSV, 
-# greppable (space separated).
-def export_output(results:list, path:str, format='json', max_len=-1, **options):
-        
-    if format == 'greppable':
-        pass
+# Fields written for every (url, method) probe, in order
+OUTPUT_FIELDS = [
+    'Url',
+    'Method',
+    'Request-Success',
+    'Status-Code',
+    'Response-Content',
+    'Response-Content-Type',
+    'Response-Size-Bytes',
+    'Response-Hash',
+    'Response-ETag',
+    'Response-Last-Modified',
+    'Request-Error',
+] + ['Time-{}-Ms'.format(phase) for phase in PHASES] + ['Change']
 
-    elif format.lower() == 'json':
-        # Create a list of JSON obkjects
-        json_objects = []
-        for result in results:
-            for method in list(result[1].keys()):
+# With `with_content` False the body is left out: it is referenced by
+# Response-Hash and kept once in a BodyTable instead. A body that was not read
+# to the end has no hash and stays in the row. `change` says how the result
+# differs from a baseline scan.
+def result_row(url, method, result, max_len=-1, with_content=True, change=None):
+    content = result.content_prefix(max_len) if with_content or result.body_hash == None else None
+    timings = result.timings or [None] * len(PHASES)
 
-                
+    row = {
+        'Url': url,
+        'Method': method,
+        'Request-Success': result.request_success,
+        'Status-Code': result.status_code,
+        'Response-Content': content,
+        'Response-Content-Type': result.response_content_type,
+        'Response-Size-Bytes': result.response_size,
+        'Response-Hash': result.body_hash.hex() if result.body_hash != None else None,
+        'Response-ETag': result.etag,
+        'Response-Last-Modified': result.last_modified,
+        'Request-Error': str(result.error) if result.error != None else None,
+    }
+    for phase, seconds in zip(PHASES, timings):
+        row['Time-{}-Ms'.format(phase)] = round(seconds * 1000, 2) if seconds != None else None
+    row['Change'] = change
+    return row
+
+
+# Output writers take one URL's scan results at a time, write them straight
+# to disk and flush, so nothing is held in memory between URLs and a crash
+# keeps everything written so far. When continuing a file (`append`), a
+# writer first cuts it back to `resume_at`, the position() a scan journal
+# recorded after the last URL it has, so rows written after that are not
+# repeated; without one, back to the last complete row, so a row cut off by
+# a crash is not continued.
+
+# Offset of the last `marker` in the binary file `f` before `end`, read
+# backwards a block at a time; -1 if there is none
+def rfind_in_file(f, marker, end, block=65536):
+    pos = end
+    while pos > 0:
+        start = max(0, pos - block)
+        f.seek(start)
+        data = f.read(min(end, pos + len(marker) - 1) - start)
+        i = data.rfind(marker)
+        if i != -1:
+            return start + i
+        pos = start
+    return -1
+
+# Length to cut a file of lines back to before continuing it
+def resume_length(path, resume_at=None):
+    size = os.path.getsize(path)
+    if resume_at != None and 0 <= resume_at <= size:
+        return resume_at
+    with open(path, 'rb') as f:
+        return rfind_in_file(f, b'\n', size) + 1
+
+# JSON array. The closing bracket is only written by close(); use JSON Lines
+# when the file must stay readable after a crash.
+class JsonWriter:
+    with_content = True
+
+    def __init__(self, path, max_len=-1, indent=2, append=False, resume_at=None):
+        self.max_len = max_len
+        self.indent = indent
+        self.rows = 0
+        if append and os.path.exists(path):
+            self._reopen_array(path, resume_at)
+        else:
+            self.f = open(path, 'w')
+            self.f.write('[')
+            self.f.flush()
+
+    # Continue an existing array after its last complete object, dropping
+    # the closing bracket (if the run that wrote it got that far)
+    def _reopen_array(self, path, resume_at=None):
+        # Every object starts on a new line, and JSON strings hold no raw newlines
+        start = b'\n' + b' ' * (self.indent or 0) + b'{'
+        with open(path, 'rb') as f:
+            size = f.seek(0, os.SEEK_END)
+            if resume_at != None and 0 <= resume_at <= size:
+                size = resume_at
+            pos = rfind_in_file(f, start, size)
+            if pos != -1:
+                f.seek(pos)
+                last = f.read(size - pos).rstrip().rstrip(b']').rstrip().rstrip(b',').rstrip()
+                try:
+                    json.loads(last)
+                    pos += len(last)
+                except ValueError:
+                    # Cut off, drop it along with the comma before it
+                    pass
+            else:
+                pos = 0
+            f.seek(max(0, pos - 64))
+            before = f.read(pos - max(0, pos - 64))
+            trimmed = before.rstrip().rstrip(b']').rstrip().rstrip(b',').rstrip()
+            pos -= len(before) - len(trimmed)
+        os.truncate(path, pos)
+        self.f = open(path, 'a')
+        if pos == 0:
+            self.f.write('[')
+            self.f.flush()
+        self.rows = 0 if pos == 0 or trimmed.endswith(b'[') else 1
+
+    # Where the next row goes, for a scan journal
+    def position(self):
+        return self.f.tell()
+
+    def write(self, url, scan_results, changes={}):
+        self.write_rows([result_row(url, method, scan_results[method], self.max_len, self.with_content, changes.get(method))
+                         for method in list(scan_results.keys())])
+
+    def write_rows(self, rows):
+        for data in rows:
+            text = json.dumps(data, indent=self.indent)
+            if self.indent:
+                # Nest the object one level in, like json.dumps on the whole list
+                pad = ' ' * self.indent
+                text = '\n'.join(pad + line for line in text.split('\n'))
+            self.f.write(',\n' if self.rows else '\n')
+            self.f.write(text)
+            self.rows += 1
+        self.f.flush()
+
+    def close(self):
+        self.f.write('\n]' if self.rows else ']')
+        self.f.close()
+
+# One JSON object per line
+class JsonLinesWriter:
+    with_content = True
+
+    def __init__(self, path, max_len=-1, append=False, resume_at=None):
+        self.max_len = max_len
+        if append and os.path.exists(path):
+            os.truncate(path, resume_length(path, resume_at))
+        self.f = open(path, 'a' if append else 'w')
+
+    def position(self):
+        return self.f.tell()
+
+    def write(self, url, scan_results, changes={}):
+        self.write_rows([result_row(url, method, scan_results[method], self.max_len, self.with_content, changes.get(method))
+                         for method in list(scan_results.keys())])
 
-                data = {
-                    'Url': result[0],
-                    'Method': method,
-                    'Request-Success': result[1][method].request_success,
-                    'Status-Code': result[1][method].status_code,
-                    'Response-Content': result[1][method].response_content[:max_len] if max_len != -1 and result[1][method].response_content != None else result[1][method].response_content,
-                    'Response-Content-Type': result[1][method].response_content_type,
-                    'Response-Size-Bytes': result[1][method].response_size,
-                    'Request-Error': result[1][method].error,
-                }
+    def write_rows(self, rows):
+        for data in rows:
+            self.f.write(json.dumps(data) + '\n')
+        self.f.flush()
 
-                json_objects.append(data)
+    def close(self):
+        self.f.close()
 
+class CsvWriter:
+    with_content = True
+
+    def __init__(self, path, max_len=-1, append=False, resume_at=None):
+        self.max_len = max_len
+        if append and os.path.exists(path):
+            os.truncate(path, resume_length(path, resume_at))
+        self.f = open(path, 'a' if append else 'w', newline='')
+        self.writer = csv.writer(self.f)
+        if self.f.tell() == 0:
+            self.writer.writerow(OUTPUT_FIELDS)
+
+    def position(self):
+        return self.f.tell()
+
+    def write(self, url, scan_results, changes={}):
+        self.write_rows([result_row(url, method, scan_results[method], self.max_len, self.with_content, changes.get(method))
+                         for method in list(scan_results.keys())])
+
+    def write_rows(self, rows):
+        for data in rows:
+            data = dict(data)
+            if self.with_content:
+                data['Response-Content'] = data['Response-Content'] or 'No Content'
+            data['Response-Hash'] = data['Response-Hash'] or ''
+            data['Response-Content-Type'] = str(data['Response-Content-Type']).replace(';','&')
+            data['Response-Size-Bytes'] = data['Response-Size-Bytes'] or 0
+            data['Request-Error'] = data['Request-Error'] or 'None'
+            for field in ('Response-ETag', 'Response-Last-Modified', 'Change'):
+                data[field] = data.get(field) or ''
+            self.writer.writerow([data.get(k) for k in OUTPUT_FIELDS])
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+# Column name for an output field: Status-Code -> status_code
+def sql_column(field):
+    return field.lower().replace('-', '_')
+
+SQL_TYPES = {
+    'Request-Success': 'INTEGER',
+    'Status-Code': 'INTEGER',
+    'Response-Size-Bytes': 'INTEGER',
+}
+
+# SQLite database with one `results` row per probe and indexes on the columns
+# analysts filter by, so a scan of millions of rows can be queried without
+# reading it all. Rows are inserted in batches of `batch_rows` (or every
+# `batch_seconds`), each batch in one transaction; batch_rows=0 commits every
+# write. WAL mode lets the file be queried while the scan is still writing.
+# Its position() is the last rowid, and a transaction never leaves half a row.
+class SqliteWriter:
+    with_content = True
+    indexed = ['Url', 'Method', 'Status-Code', 'Response-Content-Type', 'Response-Hash', 'Change']
+
+    def __init__(self, path, max_len=-1, append=False, batch_rows=1000, batch_seconds=1.0, resume_at=None):
+        self.max_len = max_len
+        self.batch_rows = batch_rows
+        self.batch_seconds = batch_seconds
+        self.pending = []
+        self.flushed = time.monotonic()
+        if not append and os.path.exists(path):
+            os.remove(path)
+        self.db = sqlite3.connect(path)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+
+        columns = ', '.join('{} {}'.format(sql_column(f), SQL_TYPES.get(f, 'REAL' if f.startswith('Time-') else 'TEXT'))
+                            for f in OUTPUT_FIELDS)
+        self.db.execute('CREATE TABLE IF NOT EXISTS results ({})'.format(columns))
+        # Files from older versions may lack newer columns
+        existing = set(row[1] for row in self.db.execute('PRAGMA table_info(results)'))
+        for field in OUTPUT_FIELDS:
+            if sql_column(field) not in existing:
+                self.db.execute('ALTER TABLE results ADD COLUMN {}'.format(sql_column(field)))
+        for field in self.indexed:
+            self.db.execute('CREATE INDEX IF NOT EXISTS results_{0} ON results ({0})'.format(sql_column(field)))
+        if append and resume_at != None:
+            self.db.execute('DELETE FROM results WHERE rowid > ?', (resume_at,))
+        self.db.commit()
+        self.insert = 'INSERT INTO results ({}) VALUES ({})'.format(
+            ', '.join(sql_column(f) for f in OUTPUT_FIELDS), ', '.join('?' * len(OUTPUT_FIELDS)))
+
+    def write(self, url, scan_results, changes={}):
+        self.write_rows([result_row(url, method, scan_results[method], self.max_len, self.with_content, changes.get(method))
+                         for method in list(scan_results.keys())])
+
+    def write_rows(self, rows):
+        for data in rows:
+            self.pending.append(tuple(data.get(f) for f in OUTPUT_FIELDS))
+        if len(self.pending) >= self.batch_rows or time.monotonic() - self.flushed >= self.batch_seconds:
+            self.flush()
+
+    def position(self):
+        self.flush()
+        return self.db.execute('SELECT max(rowid) FROM results').fetchone()[0] or 0
+
+    def flush(self):
+        if self.pending:
+            with self.db:
+                self.db.executemany(self.insert, self.pending)
+            self.pending = []
+        self.flushed = time.monotonic()
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+OUTPUT_WRITERS = {
+    'json': JsonWriter,
+    'jsonl': JsonLinesWriter,
+    'csv': CsvWriter,
+    'sqlite': SqliteWriter,
+}
+
+# Unique bodies, one JSON object per line, each written the first time its
+# hash is seen. Rows written with with_content off point here by
+# Response-Hash.
+class BodyTable:
+    def __init__(self, path, max_len=-1, append=False):
+        self.max_len = max_len
+        self.seen = set()
+        if append and os.path.exists(path):
+            os.truncate(path, resume_length(path))
+            with open(path, 'r', encoding='utf8', errors='ignore') as f:
+                for line in f:
+                    try:
+                        self.seen.add(bytes.fromhex(json.loads(line)['Response-Hash']))
+                    except (ValueError, KeyError, TypeError):
+                        continue
+        self.f = open(path, 'a' if append else 'w')
+
+    def write(self, url, scan_results):
+        for method in list(scan_results.keys()):
+            result = scan_results[method]
+            if result.body_hash == None or result.body_hash in self.seen:
+                continue
+            self.seen.add(result.body_hash)
+            data = {
+                'Response-Hash': result.body_hash.hex(),
+                'Response-Content': result.content_prefix(self.max_len),
+                'Response-Content-Type': result.response_content_type,
+                'Response-Size-Bytes': result.response_size,
+                'First-Url': url,
+                'First-Method': method,
+            }
+            self.f.write(json.dumps(data) + '\n')
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+# Opens a streaming writer for `format`. Returns None for formats that have
+# no writer (greppable). With `append` an existing file is continued instead
+# of replaced, from `resume_at` if given. Pass `content=False` to leave
+# bodies out of the rows.
+def open_writer(path:str, format='json', max_len=-1, append=False, **options):
+    format = format.lower()
+    if format == 'greppable':
+        return None
+    if format not in OUTPUT_WRITERS:
+        raise ValueError('Unknown output format: \'{}\''.format(format))
+
+    if format == 'json':
         indent = 2
         if 'indent' in list(options.keys()):
             if type(options['indent']) == int:
                 indent = options['indent']
-        
-        with open(path, 'w') as f:
-                f.write(json.dumps(json_objects, indent=indent))
-            
+        writer = JsonWriter(path, max_len, indent, append, resume_at=options.get('resume_at'))
+    elif format == 'sqlite' and 'batch_rows' in options:
+        writer = SqliteWriter(path, max_len, append, options['batch_rows'], resume_at=options.get('resume_at'))
+    else:
+        writer = OUTPUT_WRITERS[format](path, max_len, append, resume_at=options.get('resume_at'))
+    if options.get('content') == False:
+        writer.with_content = False
+    return writer
 
-    elif format.lower() == 'csv':
-        header = [
-            'Url',
-            'Method',
-            'Request-Success',
-            'Status-Code',
-            'Response-Content',
-            'Response-Content-Type',
-            'Response-Size-Bytes',
-            'Request-Error',
-        ]
+# If an output location is specified the output will be redirected to a
+# file rather than STDOUT (pretty colors). If a filetype is not specified,
+# the default type JSON will be selected. All options include: JSON, JSONL,
+# CSV, SQLite, greppable (space separated).
+def export_output(results:list, path:str, format='json', max_len=-1, **options):
+    writer = open_writer(path, format, max_len, **options)
+    if writer == None:
+        return
+    try:
+        for result in results:
+            writer.write(result[0], result[1])
+    finally:
+        writer.close()
 
-        
-        with open(path, 'w', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow(header)
 
-            for result in results:
-                for method in list(result[1].keys()):
-                
-                    data = [
-                        result[0],
-                        method,
-                        result[1][method].request_success,
-                        result[1][method].status_code,
-                        # result[1][method].response_content or 'No Content',
-                        result[1][method].response_content[:max_len] if max_len != -1 else result[1][method].response_content or 'No Content',
-                        str(result[1][method].response_content_type).replace(';','&'),
-                        result[1][method].response_size or 0,
-                        result[1][method].error or 'None'
-                    ]
-                    writer.writerow(data)
+# Undo the CSV writer's text formatting so a CSV row reads like a JSON one
+def row_from_csv(data):
+    row = {}
+    for field in OUTPUT_FIELDS:
+        value = data.get(field)
+        if value in (None, ''):
+            value = None
+        elif field == 'Request-Success':
+            value = value == 'True'
+        elif field in ('Status-Code', 'Response-Size-Bytes'):
+            value = int(value)
+        elif field.startswith('Time-'):
+            value = float(value)
+        elif field == 'Response-Content' and value == 'No Content':
+            value = None
+        elif field in ('Request-Error', 'Response-Content-Type') and value == 'None':
+            value = None
+        elif field == 'Response-Content-Type':
+            # The CSV writer swaps ';' for '&'
+            value = value.replace('&', ';')
+        row[field] = value
+    return row
+
+# Elements of the JSON array in the text file `f`, decoded one at a time from
+# a buffer refilled as needed, so the array is never held whole. The buffer
+# grows with an element that does not fit, and only while it does. An array
+# cut short by a crash (no closing bracket, half an element) ends at its last
+# complete element.
+def iter_json_array(f, chunk_size=64 * 1024):
+    decoder = json.JSONDecoder()
+    buf = f.read(chunk_size).lstrip()
+    if not buf.startswith('['):
+        raise ValueError('Not a JSON array')
+    pos = 1
+    eof = False
+    while True:
+        while pos < len(buf) and buf[pos] in ' \t\r\n,':
+            pos += 1
+        if pos < len(buf) and buf[pos] == ']':
+            return
+        try:
+            if pos == len(buf):
+                raise ValueError('Need more data')
+            element, pos = decoder.raw_decode(buf, pos)
+        except ValueError:
+            if eof:
+                return
+            more = f.read(max(chunk_size, len(buf) - pos))
+            eof = not more
+            buf = buf[pos:] + more
+            pos = 0
+            continue
+        yield element
+        if pos > chunk_size:
+            buf = buf[pos:]
+            pos = 0
+
+# Rows of a file written by one of the output writers, whichever format it is
+# in. Every format is read a row at a time; a JSON array may be missing its
+# closing bracket if the scan was cut short.
+def read_rows(path):
+    with open(path, 'rb') as f:
+        sqlite = f.read(16) == b'SQLite format 3\x00'
+    if sqlite:
+        db = sqlite3.connect(path)
+        try:
+            columns = [row[1] for row in db.execute('PRAGMA table_info(results)')]
+            fields = {sql_column(f): f for f in OUTPUT_FIELDS}
+            for values in db.execute('SELECT * FROM results ORDER BY rowid'):
+                row = {}
+                for column, value in zip(columns, values):
+                    if column in fields:
+                        row[fields[column]] = value
+                if 'Request-Success' in row:
+                    row['Request-Success'] = bool(row['Request-Success'])
+                yield row
+        finally:
+            db.close()
+        return
+
+    with open(path, 'r', encoding='utf8', errors='ignore', newline='') as f:
+        start = f.read(64).lstrip()[:1]
+        f.seek(0)
+        if start == '[':
+            yield from iter_json_array(f)
+        elif start == '{':
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        elif start:
+            for data in csv.DictReader(f):
+                yield row_from_csv(data)
+
+# Results of earlier scans keyed by (url, method), for a re-scan that only
+# reports what changed. Later files override earlier ones and rows marked
+# "removed" drop their key, so a first full scan followed by the change files
+# of later runs adds up to the latest state. Only what a comparison needs is
+# kept per key.
+class Baseline:
+    # Only safe methods get conditional headers; on others they are preconditions
+    conditional_methods = ('GET', 'HEAD')
+
+    def __init__(self):
+        self.entries = {}   # (url, method) -> (success, status, hash, size, content type, etag, last modified)
+        self.compared = 0
+        self.changed = 0
+        self.not_modified = 0
+        self.removed = 0
+
+    def load(self, path):
+        for row in read_rows(path):
+            try:
+                key = (row['Url'], row['Method'])
+            except (KeyError, TypeError):
+                continue
+            if row.get('Change') == 'removed':
+                self.entries.pop(key, None)
+                continue
+            self.entries[key] = (
+                bool(row.get('Request-Success')),
+                row.get('Status-Code') or 0,
+                row.get('Response-Hash'),
+                row.get('Response-Size-Bytes'),
+                row.get('Response-Content-Type'),
+                row.get('Response-ETag'),
+                row.get('Response-Last-Modified'),
+            )
+        return len(self.entries)
+
+    def conditional_headers(self, url, method):
+        if method not in self.conditional_methods:
+            return None
+        entry = self.entries.get((url, method))
+        if entry == None or entry[1] != 200:
+            return None
+        headers = {}
+        if entry[5]:
+            headers['If-None-Match'] = entry[5]
+        if entry[6]:
+            headers['If-Modified-Since'] = entry[6]
+        return headers
+
+    # How a result differs from the baseline, or None when it does not. Two
+    # failures count as the same: their error text varies from run to run.
+    def change(self, url, method, result):
+        entry = self.entries.get((url, method))
+        if entry == None:
+            return 'new'
+        success, status, digest, size, content_type = entry[:5]
+        if not result.request_success:
+            if isinstance(result.error, str) and result.error.startswith('Skipped'):
+                # Not probed this time, so nothing is known about it
+                return None
+            return 'failed' if success else None
+        if not success:
+            return 'recovered'
+        if result.status_code == 304:
+            return None
+        if result.status_code != status:
+            return 'status {} -> {}'.format(status, result.status_code)
+        if digest != None and result.body_hash != None:
+            if digest != result.body_hash.hex():
+                return 'body changed'
+        elif size != result.response_size:
+            return 'size {} -> {}'.format(size, result.response_size)
+        if content_type != None and content_type != result.response_content_type:
+            return 'content type changed'
+        return None
+
+    # method -> change for the results of a URL that changed. The keys of
+    # every result are taken off the baseline, so what is left after a scan
+    # was not seen again.
+    def changes(self, url, scan_results):
+        changes = {}
+        for method, result in scan_results.items():
+            change = self.change(url, method, result)
+            if change != None:
+                changes[method] = change
+            elif result.status_code == 304:
+                self.not_modified += 1
+            self.entries.pop((url, method), None)
+        self.compared += len(scan_results)
+        self.changed += len(changes)
+        return changes
+
+    # Rows for baseline results that no scan result matched
+    def removed_rows(self, methods, owns=None):
+        for (url, method), entry in self.entries.items():
+            if method in methods and (owns == None or owns(url)):
+                self.removed += 1
+                row = dict.fromkeys(OUTPUT_FIELDS)
+                row.update({'Url': url, 'Method': method, 'Change': 'removed'})
+                yield row
+
+# Combine the output files of several scans (say, the shards of one scan)
+# into one file in `format`. Returns the number of rows per input file.
+def merge_outputs(paths, path, format='json', **options):
+    writer = open_writer(path, format, -1, **options)
+    if writer == None:
+        raise ValueError('Cannot merge into format: \'{}\''.format(format))
+    counts = {}
+    try:
+        for input_path in paths:
+            counts[input_path] = 0
+            batch = []
+            for row in read_rows(input_path):
+                batch.append(row)
+                if len(batch) >= 1000:
+                    writer.write_rows(batch)
+                    counts[input_path] += len(batch)
+                    batch = []
+            writer.write_rows(batch)
+            counts[input_path] += len(batch)
+    finally:
+        writer.close()
+    return counts
                 
 
 class EndpointRecon:
@@ -189,487 +1134,3090 @@ class EndpointRecon:
         self.use_proxy = {}
         self.use_data = {}
         self.use_timeout = 10
+        # Probe all methods of a URL at the same time
+        self.concurrent = False
+        self.method_workers = len(METHODS)
+        self._method_pool = None
+        self._method_pool_lock = threading.Lock()
+        # Keep-alive connection pools: `pool_hosts` hosts are kept, each with
+        # up to `pool_size` idle connections
+        self.pool_hosts = 100
+        self.pool_size = 10
+        self.session = None
+        self._session_lock = threading.Lock()
+        # Bytes of each body to keep (-1 reads the whole body into memory) and
+        # how far past that to keep reading just to measure the size
+        self.capture_limit = -1
+        self.drain_limit = 1024 * 1024
+        # Optional HostRateLimiter, and how often a throttled probe is retried
+        self.rate_limiter = None
+        self.max_retries = 2
+        # host -> reason; URLs on these hosts are not probed at all
+        self.skip_hosts = {}
+        # Optional HostLiveness pre-check
+        self.liveness = None
+        # Separate connect/read timeouts (None uses use_timeout), a cap on the
+        # whole of one request, and a cap on all methods of one URL, in seconds
+        self.connect_timeout = None
+        self.read_timeout = None
+        self.request_deadline = None
+        self.url_budget = None
+        # Identical bodies are held once (None to keep a copy per result)
+        self.body_store = BodyStore()
+        # Optional MethodLearner for adaptive method skipping
+        self.method_learner = None
+        # Optional Baseline of an earlier scan, for conditional requests
+        self.baseline = None
+        # Optional ProxyPool used instead of use_proxy, and how many other
+        # proxies a probe tries when its proxy fails
+        self.proxy_pool = None
+        self.proxy_retries = 1
 
-    def try_get(self, url, headers={"Accept": "*"}, proxy={}, data={}, timeout=10,):
+    # One Session for every probe, so connections (and TLS handshakes) are
+    # reused across methods and across URLs of the same origin. Built on first
+    # use so pool settings can be changed after construction.
+    def _get_session(self):
+        with self._session_lock:
+            if self.session == None:
+                session = requests.Session()
+                # Never send cookies set by one probe along with the next one
+                session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+                adapter = TimedHTTPAdapter(
+                    pool_connections=self.pool_hosts,
+                    pool_maxsize=self.pool_size )
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self.session = session
+            return self.session
+
+    # Returns (requests sent, connections opened) over every pool used so far
+    def connection_stats(self):
+        with self._session_lock:
+            session = self.session
+        if session == None:
+            return 0, 0
+        return session.get_adapter('http://').connection_stats()
+
+    # `size` and `digest` are those of the whole body when `content` only
+    # holds a prefix of it (see BodyCapture)
+    def _save_response(self, result, status_code, headers, content, size=None, digest=None):
+        # No errors, yey!
+        result.request_success = True
+        # Save Response Content
+        body = bytes(content)
+        result.body_hash = body_digest(body) if size == None else digest
+        if self.body_store != None:
+            # Shared by what is kept, which is only a prefix when captured
+            body = self.body_store.share(body_digest(body) if size != None else result.body_hash, body)
+        result.response_body = body
+        result.response_size = size if size != None else len(content)
+        # Save Response Status
+        result.status_code = int(status_code)
+        # Save Response Content Type
+        ct = headers.get('Content-Type') or ''
+        # The same few content types repeat across millions of results
+        result.response_content_type = sys.intern(ct)
+        # Validators for conditional requests in a later --baseline scan
+        result.etag = headers.get('ETag')
+        result.last_modified = headers.get('Last-Modified')
+
+    # Proxies for a request outside the probe path (checks), from the pool
+    # when there is one
+    def check_proxies(self):
+        if self.proxy_pool != None:
+            proxy = self.proxy_pool.healthy()
+            return {'http': proxy, 'https': proxy}
+        return self.use_proxy
+
+    # Headers for one probe: use_headers, plus conditional headers when a
+    # baseline scan has validators for it
+    def request_headers(self, method, url):
+        if self.baseline != None:
+            conditional = self.baseline.conditional_headers(url, method)
+            if conditional:
+                return dict(self.use_headers, **conditional)
+        return self.use_headers
+
+    # (connect, read) timeouts, each falling back to use_timeout
+    def timeouts(self):
+        connect = self.connect_timeout if self.connect_timeout != None else self.use_timeout
+        read = self.read_timeout if self.read_timeout != None else self.use_timeout
+        return connect, read
+
+    # The earlier of `deadline` (the URL's budget, as a time.monotonic() value)
+    # and this request's own request_deadline, or None when neither is set
+    def _request_deadline(self, deadline=None):
+        if self.request_deadline == None:
+            return deadline
+        own = time.monotonic() + self.request_deadline
+        return own if deadline == None else min(deadline, own)
+
+    # Sends one request, waiting on the rate limiter first and retrying
+    # throttled (429/503) answers after their backoff. Nothing is sent once
+    # `deadline` has passed.
+    def try_method(self, method, url, headers={"Accept": "*"}, proxy={}, data={}, timeout=10, deadline=None):
+        return self._try_method(method, url, headers, proxy, data, timeout, deadline)[0]
+
+    # try_method() that also returns the response headers (None without a response)
+    def _try_method(self, method, url, headers={"Accept": "*"}, proxy={}, data={}, timeout=10, deadline=None):
+        if self.rate_limiter == None:
+            return self._send(method, url, headers, proxy, data, timeout, deadline)
+
+        host = url_host(url)
+        attempt = 0
+        result = None
+        response_headers = None
+        while True:
+            delay = self.rate_limiter.reserve(host)
+            if deadline != None and time.monotonic() + delay > deadline:
+                # Not sent, so it must not slow the host down further
+                self.rate_limiter.refund(host, delay)
+                if result == None:
+                    result = EndpointResult()
+                    result.error = 'Skipped: URL time budget used up waiting for the rate limit'
+                return result, response_headers
+            time.sleep(delay)
+            result, response_headers = self._send(method, url, headers, proxy, data, timeout, deadline)
+            if not result.request_success:
+                return result, response_headers
+            backoff = self.rate_limiter.feedback(
+                host, result.status_code, response_headers.get('Retry-After'))
+            if backoff == None or attempt >= self.max_retries:
+                return result, response_headers
+            attempt += 1
+
+    # Returns the result and the response headers (None if the request failed)
+    def _send(self, method, url, headers={"Accept": "*"}, proxy={}, data={}, timeout=10, deadline=None):
         result = EndpointResult()
         response = None
+
+        deadline = self._request_deadline(deadline)
+        if deadline != None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                result.error = 'Skipped: URL time budget used up'
+                return result, None
+            timeout = clip_timeout(timeout, remaining)
+
+        cut_off = False
+        timer = PhaseTimer()
         try:
-            response = requests.get(
-                url,
-                verify=False,
-                data=data,
-                headers=headers,
-                proxies=proxy,
-                timeout=timeout)
+            _phase_clock.timer = timer
+            try:
+                # Always streamed so the headers and the body are timed apart
+                response = self._get_session().request(
+                    method,
+                    url,
+                    verify=False,
+                    data=data,
+                    headers=headers,
+                    proxies=proxy,
+                    timeout=timeout,
+                    # Same as requests.head(): only HEAD leaves redirects alone
+                    allow_redirects=method != 'HEAD',
+                    stream=True)
+            finally:
+                _phase_clock.timer = None
+            timer.headers_received()
+
+            if self.capture_limit >= 0 or deadline != None:
+                # Read the body in chunks so the deadline is checked between them
+                limit = self.capture_limit if self.capture_limit >= 0 else sys.maxsize
+                capture = BodyCapture(limit, self.drain_limit, response.headers)
+                for chunk in iter_body(response, deadline != None):
+                    if not capture.feed(chunk):
+                        break
+                    if deadline != None and time.monotonic() > deadline:
+                        cut_off = True
+                        break
+                else:
+                    capture.complete = True
+                if not capture.complete:
+                    response.close()
+                content, size, digest = capture.content, capture.size, capture.digest
+            else:
+                content, size, digest = response.content, None, None
+            timer.body_read()
         except requests.exceptions.RequestException as re_err:
             result.error = re_err
-            return result
+            result.timings = timer.timings()
+            return result, None
         except Exception as py_err:
             result.error = py_err
-            return result
+            result.timings = timer.timings()
+            return result, None
         
+        result.timings = timer.timings()
         if response != None:
-            # No errors, yey!
-            result.request_success = True
-            # Save Response Content
-            result.response_content = response.content.decode('utf8','ignore')
-            result.response_size = len(result.response_content)
-            # Save Response Status
-            result.status_code = int(response.status_code)
-            # Save Response Content Type
-            ct = response.headers.get('Content-Type') or ''
-            result.response_content_type = ct
+            self._save_response(result, response.status_code, response.headers, content, size, digest)
+            if cut_off:
+                result.error = 'Response cut off: deadline reached after {} bytes'.format(len(content))
+            return result, response.headers
         else:
             result.error = "Unknown Error"
         
-        return result
+        return result, None
+
+    def try_get(self, url, headers={"Accept": "*"}, proxy={}, data={}, timeout=10,):
+        return self.try_method('GET', url, headers, proxy, data, timeout)
     
     def try_post(self, url, headers={"Accept": "*"}, proxy={}, data={}, timeout=10,):
-        result = EndpointResult()
-        response = None
-        try:
-            response = requests.post(
-                url,
-                verify=False,
-                data=data,
-                headers=headers,
-                proxies=proxy,
-                timeout=timeout)
-        except requests.exceptions.RequestException as re_err:
-            result.error = re_err
-            return result
-        except Exception as py_err:
-            result.error = py_err
-            return result
-        
-        if response != None:
-            # No errors, yey!
-            result.request_success = True
-            # Save Response Content
-            result.response_content = response.content.decode('utf8','ignore')
-            result.response_size = len(result.response_content)
-            # Save Response Status
-            result.status_code = int(response.status_code)
-            # Save Response Content Type
-            ct = response.headers.get('Content-Type') or ''
-            result.response_content_type = ct
-        else:
-            result.error = "Unknown Error"
-        
-        return result
+        return self.try_method('POST', url, headers, proxy, data, timeout)
     
     def try_put(self, url, headers={"Accept": "*"}, proxy={}, data={}, timeout=10,):
-        result = EndpointResult()
-        response = None
-        try:
-            response = requests.put(
-                url,
-                verify=False,
-                data=data,
-                headers=headers,
-                proxies=proxy,
-                timeout=timeout)
-        except requests.exceptions.RequestException as re_err:
-            result.error = re_err
-            return result
-        except Exception as py_err:
-            result.error = py_err
-            return result
-        
-        if response != None:
-            # No errors, yey!
-            result.request_success = True
-            # Save Response Content
-            result.response_content = response.content.decode('utf8','ignore')
-            result.response_size = len(result.response_content)
-            # Save Response Status
-            result.status_code = int(response.status_code)
-            # Save Response Content Type
-            ct = response.headers.get('Content-Type') or ''
-            result.response_content_type = ct
-        else:
-            result.error = "Unknown Error"
-        
-        return result
+        return self.try_method('PUT', url, headers, proxy, data, timeout)
     
     def try_head(self, url, headers={"Accept": "*"}, proxy={}, data={}, timeout=10,):
-        result = EndpointResult()
-        response = None
-        try:
-            response = requests.head(
-                url,
-                verify=False,
-                data=data,
-                headers=headers,
-                proxies=proxy,
-                timeout=timeout)
-        except requests.exceptions.RequestException as re_err:
-            result.error = re_err
-            return result
-        except Exception as py_err:
-            result.error = py_err
-            return result
-        
-        if response != None:
-            # No errors, yey!
-            result.request_success = True
-            # Save Response Content
-            result.response_content = response.content.decode('utf8','ignore')
-            result.response_size = len(result.response_content)
-            # Save Response Status
-            result.status_code = int(response.status_code)
-            # Save Response Content Type
-            ct = response.headers.get('Content-Type') or ''
-            result.response_content_type = ct
-        else:
-            result.error = "Unknown Error"
-        
-        return result
+        return self.try_method('HEAD', url, headers, proxy, data, timeout)
     
     def try_delete(self, url, headers={"Accept": "*"}, proxy={}, data={}, timeout=10,):
-        result = EndpointResult()
-        response = None
-        try:
-            response = requests.delete(
-                url,
-                verify=False,
-                data=data,
-                headers=headers,
-                proxies=proxy,
-                timeout=timeout)
-        except requests.exceptions.RequestException as re_err:
-            result.error = re_err
-            return result
-        except Exception as py_err:
-            result.error = py_err
-            return result
-        
-        if response != None:
-            # No errors, yey!
-            result.request_success = True
-            # Save Response Content
-            result.response_content = response.content.decode('utf8','ignore')
-            result.response_size = len(result.response_content)
-            # Save Response Status
-            result.status_code = int(response.status_code)
-            # Save Response Content Type
-            ct = response.headers.get('Content-Type') or ''
-            result.response_content_type = ct
-        else:
-            result.error = "Unknown Error"
-        
-        return result
+        return self.try_method('DELETE', url, headers, proxy, data, timeout)
     
     def try_options(self, url, headers={"Accept": "*"}, proxy={}, data={}, timeout=10,):
-        result = EndpointResult()
-        response = None
-        try:
-            response = requests.options(
-                url,
-                verify=False,
-                data=data,
-                headers=headers,
-                proxies=proxy,
-                timeout=timeout)
-        except requests.exceptions.RequestException as re_err:
-            result.error = re_err
-            return result
-        except Exception as py_err:
-            result.error = py_err
-            return result
-        
-        if response != None:
-            # No errors, yey!
-            result.request_success = True
-            # Save Response Content
-            result.response_content = response.content.decode('utf8','ignore')
-            result.response_size = len(result.response_content)
-            # Save Response Status
-            result.status_code = int(response.status_code)
-            # Save Response Content Type
-            ct = response.headers.get('Content-Type') or ''
-            result.response_content_type = ct
-        else:
-            result.error = "Unknown Error"
-        
-        return result
+        return self.try_method('OPTIONS', url, headers, proxy, data, timeout)
     
     def try_patch(self, url, headers={"Accept": "*"}, proxy={}, data={}, timeout=10,):
-        result = EndpointResult()
-        response = None
-        try:
-            response = requests.patch(
-                url,
-                verify=False,
-                data=data,
-                headers=headers,
-                proxies=proxy,
-                timeout=timeout)
-        except requests.exceptions.RequestException as re_err:
-            result.error = re_err
-            return result
-        except Exception as py_err:
-            result.error = py_err
-            return result
-        
-        if response != None:
-            # No errors, yey!
-            result.request_success = True
-            # Save Response Content
-            result.response_content = response.content.decode('utf8','ignore')
-            result.response_size = len(result.response_content)
-            # Save Response Status
-            result.status_code = int(response.status_code)
-            # Save Response Content Type
-            ct = response.headers.get('Content-Type') or ''
-            result.response_content_type = ct
-        else:
-            result.error = "Unknown Error"
-        
-        return result
+        return self.try_method('PATCH', url, headers, proxy, data, timeout)
+    
 
-        
-    def begin(self, url, except_: list=[]):
-        scan_results = {}
-        except_ = [e.upper() for e in except_]
+    # Probe one method of a URL with the recon settings
+    def probe(self, method, url, deadline=None):
+        return self._probe(method, url, deadline)[0]
 
-        begin = time.time()
+    # probe() that also returns the response headers
+    def _probe(self, method, url, deadline=None):
+        if self.proxy_pool != None:
+            return self._probe_pooled(method, url, deadline)
+        return self._try_method(
+            method,
+            url,
+            headers = self.request_headers(method, url),
+            proxy = self.use_proxy,
+            data = self.use_data,
+            timeout = self.timeouts(),
+            deadline = deadline )
 
-        # HTTP: GET
-        if 'GET' not in except_:
-            get_scan_result = self.try_get(
-                url,
-                headers = self.use_headers,
-                proxy = self.use_proxy,
-                data = self.use_data,
-                timeout = self.use_timeout )
-            
-            scan_results['GET'] = get_scan_result
+    # Probe through a proxy of the pool, moving to another proxy when the
+    # first one fails up to `proxy_retries` times
+    def _probe_pooled(self, method, url, deadline=None):
+        tried = []
+        while True:
+            proxy = self.proxy_pool.acquire(exclude=tried)
+            start = time.monotonic()
+            try:
+                result, headers = self._try_method(
+                    method,
+                    url,
+                    headers = self.request_headers(method, url),
+                    proxy = {'http': proxy, 'https': proxy},
+                    data = self.use_data,
+                    timeout = self.timeouts(),
+                    deadline = deadline )
+            except BaseException:
+                self.proxy_pool.release(proxy, None, start)
+                raise
+            failed = proxy_failed(result)
+            self.proxy_pool.release(proxy, not failed, start, request_seconds(result))
+            tried.append(proxy)
+            if not failed or len(tried) > self.proxy_retries or len(tried) >= len(self.proxy_pool.proxies):
+                return result, headers
 
-        # HTTP: POST
-        if 'POST' not in except_:
-            post_scan_result = self.try_post(
-                url,
-                headers = self.use_headers,
-                proxy = self.use_proxy,
-                data = self.use_data,
-                timeout = self.use_timeout )
-            scan_results['POST'] = post_scan_result
-
-        # HTTP: PUT
-        if 'PUT' not in except_:
-            put_scan_result = self.try_put(
-                url,
-                headers = self.use_headers,
-                proxy = self.use_proxy,
-                data = self.use_data,
-                timeout = self.use_timeout )
-            scan_results['PUT'] = put_scan_result
-
-        # HTTP: HEAD
-        if 'HEAD' not in except_:
-            head_scan_result = self.try_head(
-                url,
-                headers = self.use_headers,
-                proxy = self.use_proxy,
-                data = self.use_data,
-                timeout = self.use_timeout )
-            scan_results['HEAD'] = head_scan_result
-
-        # HTTP: DELETE
-        if 'DELETE' not in except_:
-            delete_scan_result = self.try_delete(
+    # When the URL's time budget runs out, as a time.monotonic() value
+    def _url_deadline(self):
+        if self.url_budget == None:
+            return None
+        return time.monotonic() + self.url_budget
+
+    # Threads shared by every concurrent begin() call. Created on first use so
+    # sequential scans never start a pool.
+    def _get_method_pool(self):
+        with self._method_pool_lock:
+            if self._method_pool == None:
+                self._method_pool = ThreadPoolExecutor(
+                    max_workers=self.method_workers,
+                    thread_name_prefix='urls-method')
+            return self._method_pool
+
+    def close(self):
+        if self._method_pool != None:
+            self._method_pool.shutdown(wait=True)
+            self._method_pool = None
+        if self.session != None:
+            self.session.close()
+            self.session = None
+
+    # Why nothing should be sent to the URL's host, or None
+    def host_skip_reason(self, url):
+        if self.skip_hosts:
+            reason = self.skip_hosts.get(url_host(url))
+            if reason != None:
+                return reason
+        if self.liveness != None:
+            return self.liveness.check(self, url)
+        return None
+
+    # Results for methods that were not sent. `reasons` can give a reason per
+    # method instead of the shared one.
+    def _skipped_results(self, methods, reason, reasons={}):
+        scan_results = {}
+        for method in methods:
+            result = EndpointResult()
+            result.error = reasons.get(method, reason)
+            scan_results[method] = result
+        return scan_results
+
+    def begin(self, url, except_: list=[]):
+        scan_results = {}
+        except_ = [e.upper() for e in except_]
+        methods = [m for m in METHODS if m not in except_]
+
+        reason = self.host_skip_reason(url)
+        if reason != None:
+            return self._skipped_results(methods, reason), 0.0
+
+        begin = time.time()
+        deadline = self._url_deadline()
+
+        # Adaptive mode: OPTIONS goes first, and methods the server's Allow
+        # header or earlier 405s rule out are not sent
+        learner = self.method_learner
+        skipped = {}
+        if learner != None:
+            skipped = learner.skip_reasons(url, methods)
+            if 'OPTIONS' in methods and 'OPTIONS' not in skipped:
+                result, headers = self._probe('OPTIONS', url, deadline)
+                scan_results['OPTIONS'] = result
+                skipped.update(learner.allow_reasons(result, headers, methods))
+        todo = [m for m in methods if m not in scan_results and m not in skipped]
+
+        if self.concurrent and len(todo) > 1:
+            # Every method is in flight at once, so a URL costs about as much
+            # as its slowest method rather than the sum of all of them.
+            pool = self._get_method_pool()
+            futures = [(m, pool.submit(self.probe, m, url, deadline)) for m in todo]
+            for method, future in futures:
+                scan_results[method] = future.result()
+        else:
+            for method in todo:
+                scan_results[method] = self.probe(method, url, deadline)
+
+        if learner != None:
+            scan_results.update(self._skipped_results(list(skipped.keys()), None, skipped))
+            scan_results = {m: scan_results[m] for m in methods}
+            learner.learn(url, scan_results)
+
+        end = time.time()
+        duration: float = round(end - begin, 3)
+        
+        return scan_results, duration
+
+# Same interface as EndpointRecon, but every probe is a coroutine on one event
+# loop instead of a blocking call on its own thread, so a single process can
+# keep thousands of requests in flight. `max_inflight` caps the number of
+# requests open at once across all URLs and hosts. Needs aiohttp (and
+# aiohttp-socks for SOCKS proxies).
+class AsyncEndpointRecon(EndpointRecon):
+    def __init__(self):
+        super().__init__()
+        self.max_inflight = 500
+        self._proxy_sessions = {}
+        self._requests_sent = 0
+        self._connections_opened = 0
+        # origin -> liveness check running on a thread
+        self._liveness_checks = {}
+
+        if aiohttp == None:
+            raise RuntimeError('The async engine requires aiohttp (pip install aiohttp)')
+
+    def _connector(self, proxy=None):
+        if proxy == None:
+            proxy = self.use_proxy.get('https') or self.use_proxy.get('http')
+        if proxy != None and proxy.lower().startswith('socks'):
+            try:
+                from aiohttp_socks import ProxyConnector
+            except ImportError:
+                raise RuntimeError('SOCKS proxies with the async engine require aiohttp-socks (pip install aiohttp-socks)')
+            return ProxyConnector.from_url(proxy, limit=self.max_inflight, ssl=False)
+        return aiohttp.TCPConnector(limit=self.max_inflight, ssl=False)
+
+    def _session(self, proxy=None):
+        # Count requests and new connections for connection_stats(), and time
+        # the phases of each request
+        trace = aiohttp.TraceConfig()
+        trace.on_request_start.append(self._on_request_start)
+        trace.on_dns_resolvehost_start.append(self._on_dns_resolvehost_start)
+        trace.on_dns_resolvehost_end.append(self._on_dns_resolvehost_end)
+        trace.on_connection_create_start.append(self._on_connection_create_start)
+        trace.on_connection_create_end.append(self._on_connection_create_end)
+
+        return aiohttp.ClientSession(
+            connector=self._connector(proxy),
+            cookie_jar=aiohttp.DummyCookieJar(),
+            trace_configs=[trace],
+            timeout=aiohttp.ClientTimeout(
+                total=None,
+                sock_connect=self.timeouts()[0],
+                sock_read=self.timeouts()[1] ) )
+
+    # aiohttp takes SOCKS proxies on the connector, so each SOCKS proxy of a
+    # pool gets a session of its own, opened on first use
+    def _socks_session(self, proxy):
+        session = self._proxy_sessions.get(proxy)
+        if session == None:
+            session = self._proxy_sessions[proxy] = self._session(proxy)
+        return session
+
+    async def _close_proxy_sessions(self):
+        for session in self._proxy_sessions.values():
+            await session.close()
+        self._proxy_sessions = {}
+
+    async def _on_request_start(self, session, context, params):
+        self._requests_sent += 1
+
+    async def _on_dns_resolvehost_start(self, session, context, params):
+        context.dns_started = time.perf_counter()
+
+    async def _on_dns_resolvehost_end(self, session, context, params):
+        if context.trace_request_ctx != None:
+            context.trace_request_ctx.add('DNS', time.perf_counter() - context.dns_started)
+
+    async def _on_connection_create_start(self, session, context, params):
+        context.connect_started = time.perf_counter()
+        if context.trace_request_ctx != None:
+            context.connecting_before = context.trace_request_ctx.connecting()
+
+    # aiohttp sets up TLS as part of creating the connection, so with this
+    # engine the TLS handshake is counted in Connect
+    async def _on_connection_create_end(self, session, context, params):
+        self._connections_opened += 1
+        timer = context.trace_request_ctx
+        if timer != None:
+            resolving = timer.connecting() - context.connecting_before
+            timer.add('Connect', max(0.0, time.perf_counter() - context.connect_started - resolving))
+
+    def connection_stats(self):
+        return self._requests_sent, self._connections_opened
+
+    # Coroutine version of try_method()
+    async def try_method_async(self, session, method, url, deadline=None):
+        return (await self._try_method_async(session, method, url, deadline))[0]
+
+    # Coroutine version of _probe(), through the proxy pool when there is one
+    async def _probe_async(self, session, method, url, deadline=None):
+        if self.proxy_pool == None:
+            return await self._try_method_async(session, method, url, deadline)
+
+        tried = []
+        while True:
+            proxy = self.proxy_pool.acquire(exclude=tried)
+            start = time.monotonic()
+            try:
+                result, headers = await self._try_method_async(session, method, url, deadline, proxy)
+            except BaseException:
+                self.proxy_pool.release(proxy, None, start)
+                raise
+            failed = proxy_failed(result)
+            self.proxy_pool.release(proxy, not failed, start, request_seconds(result))
+            tried.append(proxy)
+            if not failed or len(tried) > self.proxy_retries or len(tried) >= len(self.proxy_pool.proxies):
+                return result, headers
+
+    # try_method_async() that also returns the response headers
+    async def _try_method_async(self, session, method, url, deadline=None, proxy=None):
+        if self.rate_limiter == None:
+            return await self._send_async(session, method, url, deadline, proxy)
+
+        host = url_host(url)
+        attempt = 0
+        result = None
+        response_headers = None
+        while True:
+            delay = self.rate_limiter.reserve(host)
+            if deadline != None and time.monotonic() + delay > deadline:
+                # Not sent, so it must not slow the host down further
+                self.rate_limiter.refund(host, delay)
+                if result == None:
+                    result = EndpointResult()
+                    result.error = 'Skipped: URL time budget used up waiting for the rate limit'
+                return result, response_headers
+            await asyncio.sleep(delay)
+            result, response_headers = await self._send_async(session, method, url, deadline, proxy)
+            if not result.request_success:
+                return result, response_headers
+            backoff = self.rate_limiter.feedback(
+                host, result.status_code, response_headers.get('Retry-After'))
+            if backoff == None or attempt >= self.max_retries:
+                return result, response_headers
+            attempt += 1
+
+    # `proxy` (from a pool) overrides use_proxy
+    async def _send_async(self, session, method, url, deadline=None, proxy=None):
+        result = EndpointResult()
+        if proxy == None:
+            proxy = self.use_proxy.get(urlsplit(url).scheme)
+            if proxy != None and proxy.lower().startswith('socks'):
+                # Handled by the connector
+                proxy = None
+        elif proxy.lower().startswith('socks'):
+            session = self._socks_session(proxy)
+            proxy = None
+
+        timeout = None
+        deadline = self._request_deadline(deadline)
+        if deadline != None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                result.error = 'Skipped: URL time budget used up'
+                return result, None
+            connect, read = clip_timeout(self.timeouts(), remaining)
+            timeout = aiohttp.ClientTimeout(total=None, sock_connect=connect, sock_read=read)
+
+        cut_off = False
+        timer = None
+        try:
+            async with self._inflight:
+                # Started once a slot is free, waiting for one is not a phase
+                timer = PhaseTimer()
+                request = session.request(
+                    method,
+                    url,
+                    data=self.use_data or None,
+                    headers=self.request_headers(method, url),
+                    proxy=proxy,
+                    timeout=timeout,
+                    trace_request_ctx=timer,
+                    # Same as requests: follow redirects except for HEAD
+                    allow_redirects=method != 'HEAD')
+                if deadline != None:
+                    # The headers must be in by the deadline, the body is
+                    # read up to it like the threads engine does
+                    response = await asyncio.wait_for(request, max(0.0, deadline - time.monotonic()))
+                else:
+                    response = await request
+                try:
+                    timer.headers_received()
+
+                    if self.capture_limit >= 0 or deadline != None:
+                        limit = self.capture_limit if self.capture_limit >= 0 else sys.maxsize
+                        capture = BodyCapture(limit, self.drain_limit, response.headers)
+                        while True:
+                            if deadline != None:
+                                try:
+                                    chunk = await asyncio.wait_for(
+                                        response.content.readany(), max(0.0, deadline - time.monotonic()))
+                                except asyncio.TimeoutError:
+                                    cut_off = True
+                                    break
+                            else:
+                                chunk = await response.content.readany()
+                            if not chunk:
+                                capture.complete = True
+                                break
+                            if not capture.feed(chunk):
+                                break
+                        if not capture.complete:
+                            response.close()
+                        content, size, digest = capture.content, capture.size, capture.digest
+                    else:
+                        content, size, digest = await response.read(), None, None
+                    timer.body_read()
+                    status_code = response.status
+                    headers = response.headers
+                finally:
+                    response.release()
+        except asyncio.TimeoutError as re_err:
+            if deadline != None and time.monotonic() >= deadline:
+                result.error = 'Request deadline reached'
+            else:
+                result.error = str(re_err) or re_err.__class__.__name__
+            if timer != None:
+                result.timings = timer.timings()
+            return result, None
+        except aiohttp.ClientError as re_err:
+            result.error = re_err if str(re_err) else re_err.__class__.__name__
+            if timer != None:
+                result.timings = timer.timings()
+            return result, None
+        except Exception as py_err:
+            result.error = py_err
+            if timer != None:
+                result.timings = timer.timings()
+            return result, None
+
+        self._save_response(result, status_code, headers, content, size, digest)
+        result.timings = timer.timings()
+        if cut_off:
+            result.error = 'Response cut off: deadline reached after {} bytes'.format(len(content))
+        return result, headers
+
+    # host_skip_reason() without blocking the event loop. Answers already known
+    # are looked up on the loop; an origin not checked yet is checked once on a
+    # thread, and its other URLs wait for that check rather than each holding
+    # a thread of the default executor (which aiohttp's resolver shares).
+    async def host_skip_reason_async(self, url):
+        if self.liveness == None:
+            return self.host_skip_reason(url)
+        if self.skip_hosts:
+            reason = self.skip_hosts.get(url_host(url))
+            if reason != None:
+                return reason
+        try:
+            origin = self.liveness.origin(url)
+        except ValueError:
+            # Answered without a check
+            return self.liveness.check(self, url)
+        if origin in self.liveness.results:
+            return self.liveness.results[origin]
+        check = self._liveness_checks.get(origin)
+        if check == None:
+            check = asyncio.ensure_future(asyncio.to_thread(self.liveness.check, self, url))
+            self._liveness_checks[origin] = check
+            check.add_done_callback(lambda _: self._liveness_checks.pop(origin, None))
+        # Shielded: a cancelled URL must not cancel the check others wait on
+        return await asyncio.shield(check)
+
+    async def begin_async(self, session, url, except_: list=[]):
+        except_ = [e.upper() for e in except_]
+        methods = [m for m in METHODS if m not in except_]
+
+        reason = await self.host_skip_reason_async(url)
+        if reason != None:
+            return self._skipped_results(methods, reason), 0.0
+
+        begin = time.time()
+        deadline = self._url_deadline()
+
+        # Adaptive mode, as in EndpointRecon.begin()
+        scan_results = {}
+        learner = self.method_learner
+        skipped = {}
+        if learner != None:
+            skipped = learner.skip_reasons(url, methods)
+            if 'OPTIONS' in methods and 'OPTIONS' not in skipped:
+                result, headers = await self._probe_async(session, 'OPTIONS', url, deadline)
+                scan_results['OPTIONS'] = result
+                skipped.update(learner.allow_reasons(result, headers, methods))
+        todo = [m for m in methods if m not in scan_results and m not in skipped]
+
+        # All methods of a URL always go out together, bounded by max_inflight
+        results = await asyncio.gather(
+            *[self._probe_async(session, m, url, deadline) for m in todo])
+        scan_results.update(zip(todo, [r[0] for r in results]))
+
+        if learner != None:
+            scan_results.update(self._skipped_results(list(skipped.keys()), None, skipped))
+            scan_results = {m: scan_results[m] for m in methods}
+            learner.learn(url, scan_results)
+
+        end = time.time()
+        duration: float = round(end - begin, 3)
+
+        return scan_results, duration
+
+    # Blocking single URL scan for callers of the EndpointRecon interface
+    def begin(self, url, except_: list=[]):
+        async def run():
+            self._inflight = asyncio.Semaphore(self.max_inflight)
+            try:
+                async with self._session() as session:
+                    return await self.begin_async(session, url, except_)
+            finally:
+                await self._close_proxy_sessions()
+        return asyncio.run(run())
+
+    # Async counterpart of scan_urls(). Runs the event loop on a background
+    # thread and yields (index, url, scan_results, duration) in input order.
+    def scan_urls(self, urls, except_: list=[], per_host=0, window=0):
+        window = window or self.max_inflight
+        out = queue.Queue(maxsize=window)
+        done_marker = object()
+        # Set when the consumer stops iterating, early or on an error
+        stopping = threading.Event()
+        running = {}
+
+        # Blocks until the consumer has room for `item`; False once it stopped
+        def hand_over(item):
+            while not stopping.is_set():
+                try:
+                    out.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        async def scan_all():
+            running['loop'] = asyncio.get_running_loop()
+            running['task'] = asyncio.current_task()
+            if stopping.is_set():
+                return
+            self._inflight = asyncio.Semaphore(self.max_inflight)
+            host_slots = {}
+            finished = {}
+            next_index = 0
+            room = asyncio.Semaphore(window)
+            flushing = asyncio.Lock()
+
+            # Hand finished URLs to the consumer in input order
+            async def flush():
+                nonlocal next_index
+                async with flushing:
+                    while next_index in finished:
+                        item = finished.pop(next_index)
+                        if not isinstance(item, BaseException):
+                            item = (next_index,) + item
+                        if not await asyncio.to_thread(hand_over, item):
+                            return
+                        room.release()
+                        next_index += 1
+
+            async def scan_one(session, index, url):
+                try:
+                    if per_host > 0:
+                        slot = host_slots.setdefault(url_host(url), asyncio.Semaphore(per_host))
+                        async with slot:
+                            res, duration = await self.begin_async(session, url, except_)
+                    else:
+                        res, duration = await self.begin_async(session, url, except_)
+                    finished[index] = (url, res, duration)
+                except Exception as err:
+                    finished[index] = err
+                await flush()
+
+            try:
+                async with self._session() as session:
+                    tasks = []
+                    for index, url in enumerate(urls):
+                        # Read ahead at most `window` URLs past the oldest unfinished one
+                        await room.acquire()
+                        tasks.append(asyncio.create_task(scan_one(session, index, url)))
+                        if len(tasks) >= window:
+                            tasks = [t for t in tasks if not t.done()]
+                    await asyncio.gather(*tasks)
+            finally:
+                await self._close_proxy_sessions()
+
+        def run():
+            try:
+                asyncio.run(scan_all())
+                hand_over(done_marker)
+            except BaseException as err:
+                hand_over(err)
+
+        loop_thread = threading.Thread(target=run, name='urls-async', daemon=True)
+        loop_thread.start()
+        try:
+            while True:
+                item = out.get()
+                if item is done_marker:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            # Also reached when the consumer breaks off or is closed: cancel
+            # whatever is still running so the loop thread can finish
+            stopping.set()
+            loop = running.get('loop')
+            if loop != None:
+                try:
+                    loop.call_soon_threadsafe(running['task'].cancel)
+                except RuntimeError:
+                    # The loop is already closed
+                    pass
+            loop_thread.join()
+
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+# URLs read lazily from a file, one per line, so a list of any size costs
+# no memory up front and the scan starts on the first line. Plain files are
+# memory-mapped: the OS pages them in as they are read and can drop pages
+# already scanned; pipes and FIFOs are read as a stream. Gzip input (spotted by
+# its magic bytes) is decompressed as a stream, and '-' reads standard input.
+# Iterating again rereads the file, except for standard input and pipes.
+class UrlFile:
+    release_bytes = 16 * 1024 * 1024
+
+    def __init__(self, path):
+        self.path = path
+
+    @property
+    def rereadable(self):
+        if self.path == '-':
+            return False
+        try:
+            return stat.S_ISREG(os.stat(self.path).st_mode)
+        except OSError:
+            return False
+
+    # Raise now rather than on the first read if the file cannot be opened
+    def check(self):
+        if self.path != '-':
+            open(self.path, 'rb').close()
+
+    def _lines(self):
+        if self.path == '-':
+            yield from self._stream(sys.stdin.buffer)
+            return
+        with open(self.path, 'rb') as f:
+            if not stat.S_ISREG(os.fstat(f.fileno()).st_mode):
+                # A pipe or FIFO, e.g. from process substitution
+                yield from self._stream(f)
+                return
+            if f.read(2) == b'\x1f\x8b':
+                f.seek(0)
+                with gzip.open(f, 'rb') as gz:
+                    yield from gz
+                return
+            try:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty file
+                return
+            with mm:
+                if hasattr(mmap, 'MADV_SEQUENTIAL'):
+                    mm.madvise(mmap.MADV_SEQUENTIAL)
+                # Hand pages already read back to the OS as the scan moves on
+                release = hasattr(mmap, 'MADV_DONTNEED')
+                read = released = 0
+                for line in iter(mm.readline, b''):
+                    yield line
+                    read += len(line)
+                    if release and read - released >= self.release_bytes:
+                        upto = read - read % mmap.PAGESIZE
+                        mm.madvise(mmap.MADV_DONTNEED, released, upto - released)
+                        released = upto
+
+    # Lines of a stream that cannot be mapped or rewound. The gzip magic bytes
+    # are peeked at in the read buffer, so nothing is consumed.
+    def _stream(self, f):
+        if f.peek(2)[:2] == b'\x1f\x8b':
+            with gzip.open(f, 'rb') as gz:
+                yield from gz
+        else:
+            yield from f
+
+    def __iter__(self):
+        for line in self._lines():
+            if line.startswith(b'http'):
+                yield line.decode('utf8', 'ignore').strip()
+
+    # Number of URLs, found by reading the whole file once
+    def count(self):
+        return sum(1 for _ in self)
+
+
+# A wordlist of paths, one per line, read like a URL file. Blank lines and
+# '#' comments are left out.
+class WordFile(UrlFile):
+    def __iter__(self):
+        for line in self._lines():
+            word = line.decode('utf8', 'ignore').strip()
+            if word and not word.startswith('#'):
+                yield word
+
+
+# `word` appended to the path of `base`, which loses its query and fragment
+def expand_url(base, word):
+    parts = urlsplit(base)
+    path = parts.path.rstrip('/') + '/' + quote(word.lstrip('/'), safe="/?&=%:@!$'()*+,;~")
+    return urlunsplit((parts.scheme, parts.netloc, path, '', ''))
+
+
+# Target URLs made from base URLs and a wordlist, generated as the scan goes.
+# Each word is tried on every base before the next one is read, so memory does
+# not grow with the wordlist and requests are spread over the hosts. A base
+# whose first `evidence` paths all got the same answer (same status and body
+# for every method, a 404/410 not counting) answers any path that way, and the
+# rest of the wordlist is skipped for it.
+class PathExpander:
+    not_found = (404, 410)
+    max_pending = 100000
+
+    def __init__(self, bases, words, evidence=5):
+        # Bases that expand to the same URLs are kept once
+        unique = OrderedDict()
+        for base in bases:
+            unique.setdefault(normalize_url(expand_url(base, '')), base)
+        self.bases = list(unique.values())
+        self.words = words
+        self.evidence = evidence
+        self.pruned_bases = {}
+        self.pruned = 0
+        self.answers = {}
+        # Base of each URL handed out and not learned from yet
+        self.base_of = OrderedDict()
+
+    @property
+    def rereadable(self):
+        return self.words.rereadable
+
+    # Number of URLs, found by reading the whole wordlist once
+    def count(self):
+        return len(self.bases) * self.words.count()
+
+    def __iter__(self):
+        for word in self.words:
+            for base in self.bases:
+                if base in self.pruned_bases:
+                    self.pruned += 1
+                    continue
+                url = expand_url(base, word)
+                self.base_of[url] = base
+                if len(self.base_of) > self.max_pending:
+                    self.base_of.popitem(last=False)
+                yield url
+
+    # A body not read to the end has no hash, its size stands in for it
+    def signature(self, scan_results):
+        return tuple(
+            (method, result.status_code if result.request_success else None,
+                result.body_hash if result.body_hash != None else result.response_size)
+            for method, result in scan_results.items() )
+
+    def learn(self, url, scan_results):
+        base = self.base_of.pop(url, None)
+        if base == None or self.evidence <= 0 or base in self.pruned_bases:
+            return
+        if any(r.request_success and r.status_code in self.not_found for r in scan_results.values()):
+            return
+        signature = self.signature(scan_results)
+        seen = self.answers.get(base)
+        if seen == None:
+            self.answers[base] = [signature, 1]
+        elif seen[0] == None:
+            # Already answered paths differently
+            return
+        elif seen[0] == signature:
+            seen[1] += 1
+        else:
+            seen[0] = None
+            return
+        if self.answers[base][1] >= self.evidence:
+            self.pruned_bases[base] = signature
+            del self.answers[base]
+
+
+# Canonical form of a URL for spotting duplicates: scheme and host lower-cased,
+# default port dropped, an empty path made '/', trailing slashes dropped from
+# other paths, query parameters sorted and the fragment (never sent) removed.
+def normalize_url(url):
+    url = url.strip()
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        return url
+
+    scheme = parts.scheme.lower()
+    host = parts.hostname or ''
+    if ':' in host:
+        host = '[{}]'.format(host)
+    netloc = host
+    if port != None and DEFAULT_PORTS.get(scheme) != port:
+        netloc = '{}:{}'.format(netloc, port)
+    if parts.username != None:
+        userinfo = parts.username
+        if parts.password != None:
+            userinfo = '{}:{}'.format(userinfo, parts.password)
+        netloc = '{}@{}'.format(userinfo, netloc)
+
+    path = parts.path or '/'
+    if len(path) > 1:
+        path = path.rstrip('/') or '/'
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+
+    return urlunsplit((scheme, netloc, path, query, ''))
+
+
+# Fixed-size Bloom filter sized for `capacity` items at `error_rate` false
+# positives. Uses a fraction of the memory of a set, at the cost of
+# occasionally reporting an unseen item as seen.
+class BloomFilter:
+    def __init__(self, capacity, error_rate=0.001):
+        capacity = max(1, capacity)
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, int(round(self.size / capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, data):
+        digest = hashlib.blake2b(data, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    # Adds `data` and returns True if it was (probably) already there
+    def add(self, data):
+        seen = True
+        for pos in self._positions(data):
+            byte, bit = pos >> 3, 1 << (pos & 7)
+            if not self.bits[byte] & bit:
+                seen = False
+                self.bits[byte] |= bit
+        return seen
+
+
+# Drops URLs that normalize to one already seen. Keeps an 8-byte digest per
+# unique URL instead of the URL itself, or a Bloom filter when given a
+# `bloom_capacity` for lists too big for that.
+class UrlDedup:
+    def __init__(self, bloom_capacity=0, error_rate=0.001):
+        self.bloom = BloomFilter(bloom_capacity, error_rate) if bloom_capacity > 0 else None
+        self.seen = set()
+        self.unique = 0
+        self.duplicates = 0
+
+    def is_duplicate(self, url):
+        key = normalize_url(url).encode('utf8', 'ignore')
+        if self.bloom != None:
+            duplicate = self.bloom.add(key)
+        else:
+            digest = hashlib.blake2b(key, digest_size=8).digest()
+            duplicate = digest in self.seen
+            self.seen.add(digest)
+
+        if duplicate:
+            self.duplicates += 1
+        else:
+            self.unique += 1
+        return duplicate
+
+    # Yield the first occurrence of every URL, as given
+    def filter(self, urls):
+        for url in urls:
+            if not self.is_duplicate(url):
+                yield url
+
+
+# Splits a scan over `count` machines by host: shard `index` (0-based) only
+# scans the URLs whose host maps to it. Every URL of a host lands on the same
+# shard, so per-host limits still hold across the fleet, and nodes agree on
+# the split without talking to each other. Uses jump consistent hashing, so
+# growing from N to N+1 shards only moves about 1/(N+1) of the hosts.
+class HostShard:
+    def __init__(self, index, count):
+        if count < 1 or not 0 <= index < count:
+            raise ValueError('Shard {} is not between 1 and {}'.format(index + 1, count))
+        self.index = index
+        self.count = count
+        self.others = 0
+
+    # "i/N" with i counted from 1
+    @classmethod
+    def parse(cls, value):
+        try:
+            index, count = [int(part) for part in str(value).split('/')]
+        except ValueError:
+            raise ValueError('Shard must look like i/N, for example 1/4: \'{}\''.format(value))
+        return cls(index - 1, count)
+
+    @staticmethod
+    def jump_hash(key, buckets):
+        b, j = -1, 0
+        while j < buckets:
+            b = j
+            key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+            j = int((b + 1) * (float(1 << 31) / float((key >> 33) + 1)))
+        return b
+
+    def shard_of(self, url):
+        key = int.from_bytes(hashlib.blake2b(url_host(url).encode(), digest_size=8).digest(), 'big')
+        return self.jump_hash(key, self.count)
+
+    def owns(self, url):
+        return self.shard_of(url) == self.index
+
+    def filter(self, urls):
+        for url in urls:
+            if self.owns(url):
+                yield url
+            else:
+                self.others += 1
+
+
+# Whether a failed probe points at the proxy it went through: the proxy (or
+# the connection through it) could not be set up. Answers of any status, read
+# timeouts and TLS errors of the target do not count.
+def proxy_failed(result):
+    err = result.error
+    if result.request_success or err == None or isinstance(err, str):
+        return False
+    if isinstance(err, requests.exceptions.SSLError):
+        return False
+    if isinstance(err, requests.exceptions.ConnectionError):
+        return True
+    if aiohttp != None and isinstance(err, aiohttp.ClientConnectorError):
+        return not isinstance(err, aiohttp.ClientConnectorCertificateError)
+    return False
+
+
+class ProxyHealth:
+    def __init__(self):
+        self.inflight = 0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive = 0
+        self.latency = None          # moving average, seconds
+        self.ejected_until = 0.0
+        self.ejected_at = 0.0
+        self.ejections = 0
+        self.recent = deque(maxlen=20)
+
+    def failure_rate(self):
+        if not self.recent:
+            return 0.0
+        return self.recent.count(False) / len(self.recent)
+
+
+# Spreads probes over several proxies, round-robin or to the proxy with the
+# lowest average latency weighted by the requests it has in flight. A proxy
+# that fails `max_failures` times in a row, while failing clearly more often
+# than the rest of the pool (a dead target makes every proxy fail alike), is
+# ejected for `eject_seconds`, doubling on each ejection in a row up to
+# `max_eject_seconds`. After that it gets traffic again; a success clears
+# its record. Failures of requests sent before the latest ejection, or while
+# ejected, are not held against it again. With every proxy ejected the one
+# due back first is used.
+class ProxyPool:
+    strategies = ['round-robin', 'least-latency']
+
+    def __init__(self, proxies, strategy='round-robin', max_failures=3, eject_seconds=30.0, max_eject_seconds=600.0):
+        if not proxies:
+            raise ValueError('The proxy pool is empty')
+        if strategy not in self.strategies:
+            raise ValueError('Unknown proxy strategy: \'{}\''.format(strategy))
+        self.proxies = list(proxies)
+        self.strategy = strategy
+        self.max_failures = max_failures
+        self.eject_seconds = eject_seconds
+        self.max_eject_seconds = max_eject_seconds
+        self.health = {p: ProxyHealth() for p in self.proxies}
+        self.ejected = 0
+        self._next = 0
+        self._lock = threading.Lock()
+
+    # One proxy per line; blank lines and '#' comments are skipped
+    @classmethod
+    def from_file(cls, path, **options):
+        with open(path, 'r', encoding='utf8', errors='ignore') as f:
+            proxies = [line.strip() for line in f if line.strip() and not line.strip().startswith('#')]
+        return cls(proxies, **options)
+
+    # Pick a proxy for one request, other than those in `exclude` when
+    # possible. Every acquire() must be followed by a release() with the
+    # time.monotonic() of the acquire.
+    def acquire(self, exclude=()):
+        with self._lock:
+            now = time.monotonic()
+            candidates = [p for p in self.proxies if p not in exclude and self.health[p].ejected_until <= now]
+            if not candidates:
+                candidates = [p for p in self.proxies if p not in exclude] or self.proxies
+                candidates = [min(candidates, key=lambda p: self.health[p].ejected_until)]
+
+            if self.strategy == 'least-latency':
+                # Untried proxies first, then fastest relative to their load
+                proxy = min(candidates, key=lambda p: (self.health[p].latency or 0.0) * (self.health[p].inflight + 1))
+            else:
+                proxy = candidates[0]
+                for i in range(len(self.proxies)):
+                    p = self.proxies[(self._next + i) % len(self.proxies)]
+                    if p in candidates:
+                        proxy = p
+                        break
+                self._next = (self.proxies.index(proxy) + 1) % len(self.proxies)
+
+            self.health[proxy].inflight += 1
+            return proxy
+
+    # Record how a request through `proxy` acquired at `started` went (ok
+    # None: it was cut short and says nothing about the proxy). `seconds` is
+    # how long the request itself took, without rate limit waits or queueing;
+    # without it the latency average is left as it is.
+    def release(self, proxy, ok, started, seconds=None):
+        with self._lock:
+            now = time.monotonic()
+            health = self.health[proxy]
+            health.inflight -= 1
+            if ok == None:
+                return
+            health.requests += 1
+            if not ok and (started < health.ejected_at or now < health.ejected_until):
+                # Part of the outage it was already ejected for
+                health.failures += 1
+                return
+            health.recent.append(ok)
+            if ok:
+                health.consecutive = 0
+                health.ejections = 0
+                if seconds != None and health.latency == None:
+                    health.latency = seconds
+                elif seconds != None:
+                    health.latency = health.latency * 0.7 + seconds * 0.3
+                return
+
+            health.failures += 1
+            health.consecutive += 1
+            if health.consecutive >= self.max_failures and self._worse_than_pool(proxy):
+                health.ejections += 1
+                health.ejected_at = now
+                health.ejected_until = now + min(
+                    self.max_eject_seconds, self.eject_seconds * 2 ** (health.ejections - 1))
+                health.consecutive = 0
+                self.ejected += 1
+
+    # A proxy that is not ejected (or the one due back first), without
+    # counting a request against it
+    def healthy(self):
+        with self._lock:
+            return min(self.proxies, key=lambda p: max(self.health[p].ejected_until, time.monotonic()))
+
+    def _worse_than_pool(self, proxy):
+        others = [self.health[p].failure_rate() for p in self.proxies if p != proxy and self.health[p].recent]
+        if len(self.proxies) < 2:
+            # Nowhere else to send requests
+            return False
+        if not others:
+            return True
+        median = sorted(others)[len(others) // 2]
+        return self.health[proxy].failure_rate() > median * 2 + 0.1
+
+    # (proxy, requests, failures, average latency, ejected now) for every proxy
+    def summary(self):
+        with self._lock:
+            return [(p, h.requests, h.failures, h.latency, h.ejected_until > time.monotonic())
+                    for p, h in self.health.items()]
+
+
+# Response codes that mean "slow down"
+THROTTLE_CODES = (429, 503)
+
+# Per-host token bucket with adaptive backoff. Each host may send `rate`
+# requests per second with bursts of up to `burst` (rate 0 leaves it
+# unlimited). A 429 or 503 blocks the host for its Retry-After, or an
+# exponential backoff capped at `max_backoff` when there is none, and halves
+# the host's rate. Later successes add the rate back bit by bit. reserve()
+# only computes the wait, so blocking threads and coroutines can both use it.
+class HostRateLimiter:
+    def __init__(self, rate=0.0, burst=0, max_backoff=60.0, base_backoff=1.0):
+        self.rate = float(rate)
+        self.burst = max(1, burst or int(math.ceil(self.rate)) or 1)
+        self.max_backoff = max_backoff
+        self.base_backoff = base_backoff
+        self.hosts = {}
+        self.throttled = 0
+        self.waited = 0.0
+        self._lock = threading.Lock()
+
+    def _state(self, host, now):
+        state = self.hosts.get(host)
+        if state == None:
+            state = {
+                'tokens': float(self.burst),
+                'updated': now,
+                'rate': self.rate,
+                'blocked_until': 0.0,
+                'strikes': 0,
+            }
+            self.hosts[host] = state
+        return state
+
+    # Takes a slot for one request to `host`; returns seconds to wait first
+    def reserve(self, host):
+        with self._lock:
+            now = time.monotonic()
+            state = self._state(host, now)
+            delay = 0.0
+            if state['rate'] > 0:
+                state['tokens'] = min(
+                    self.burst,
+                    state['tokens'] + (now - state['updated']) * state['rate'])
+                state['updated'] = now
+                state['tokens'] -= 1
+                if state['tokens'] < 0:
+                    delay = -state['tokens'] / state['rate']
+            delay = max(delay, state['blocked_until'] - now)
+            self.waited += delay
+            return delay
+
+    # Gives back the slot reserve() took (and said to wait `delay` for) when
+    # the request ends up not being sent
+    def refund(self, host, delay):
+        with self._lock:
+            state = self.hosts.get(host)
+            if state != None and state['rate'] > 0:
+                state['tokens'] = min(self.burst, state['tokens'] + 1)
+            self.waited -= delay
+
+    # Reports a response from `host`. Returns the backoff in seconds when the
+    # host asked us to slow down, None otherwise.
+    def feedback(self, host, status_code, retry_after=None):
+        with self._lock:
+            now = time.monotonic()
+            state = self._state(host, now)
+
+            if status_code not in THROTTLE_CODES:
+                if state['strikes'] or state['rate'] < self.rate:
+                    state['strikes'] = 0
+                    state['rate'] = min(self.rate, state['rate'] + self.rate / 10)
+                return None
+
+            self.throttled += 1
+            state['strikes'] += 1
+            delay = parse_retry_after(retry_after)
+            if delay == None:
+                delay = self.base_backoff * 2 ** (state['strikes'] - 1)
+                delay *= random.uniform(0.8, 1.2)
+            delay = min(delay, self.max_backoff)
+            state['blocked_until'] = max(state['blocked_until'], now + delay)
+            if self.rate > 0:
+                state['rate'] = max(self.rate / 64, state['rate'] / 2)
+            return delay
+
+
+# Seconds from a Retry-After header (delay-seconds or HTTP-date), or None
+def parse_retry_after(value):
+    if value == None:
+        return None
+    value = str(value).strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if when == None:
+        return None
+    if when.tzinfo == None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+# Append-only record of every URL that finished, one JSON object per line with
+# all its methods and the output position after its rows, so an interrupted
+# scan can skip what it already did. A line cut short by a crash is ignored on
+# load, which leaves its URL to be scanned again and the output position at
+# the URL before. Per-method lines of older journals are still read.
+class ScanJournal:
+    def __init__(self, path):
+        self.path = path
+        self.done = {}      # url -> set of finished methods
+        self.skipped = 0
+        # Output writer position after the last recorded URL
+        self.output_position = None
+        self.f = None
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return 0
+        with open(self.path, 'r', encoding='utf8', errors='ignore') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    if 'methods' in entry:
+                        self.done.setdefault(entry['url'], set()).update(entry['methods'])
+                        if 'output' in entry:
+                            self.output_position = entry['output']
+                    else:
+                        self.done.setdefault(entry['url'], set()).add(entry['method'])
+                except (ValueError, KeyError, TypeError):
+                    continue
+        return len(self.done)
+
+    def is_done(self, url, methods):
+        finished = self.done.get(url)
+        return finished != None and finished.issuperset(methods)
+
+    # Yield only URLs that still have methods left to scan
+    def pending(self, urls, methods):
+        for url in urls:
+            if self.is_done(url, methods):
+                self.skipped += 1
+                continue
+            yield url
+
+    def record(self, url, scan_results, output_position=None):
+        if self.f == None:
+            self.f = open(self.path, 'a', encoding='utf8')
+        entry = {
+            'url': url,
+            'methods': {
+                method: [result.request_success, result.status_code]
+                for method, result in scan_results.items() },
+        }
+        if output_position != None:
+            entry['output'] = output_position
+        # One line per URL, written in one go
+        self.f.write(json.dumps(entry) + '\n')
+        self.f.flush()
+
+    def close(self):
+        if self.f != None:
+            self.f.close()
+            self.f = None
+
+
+# Live counters of a running scan, for the progress line and the metrics
+# endpoint. Updated by the scan loop as each URL finishes and read from other
+# threads. Rates are taken over the last `window` seconds so they follow the
+# scan as it speeds up or stalls. `passed_over` optionally returns how many
+# input URLs were dropped without a scan (duplicates, already journaled), which
+# count towards `total`.
+class ScanProgress:
+    def __init__(self, total=None, window=10.0):
+        self.total = total
+        self.window = window
+        self.started = time.monotonic()
+        self.last_finished = self.started
+        self.urls_done = 0
+        self.probes = 0
+        self.errors = 0
+        self.skipped = 0
+        self.status_codes = {}
+        self.passed_over = None
+        self._recent = deque()     # (time, urls, probes) samples
+        self._lock = threading.Lock()
+
+    def update(self, scan_results):
+        now = time.monotonic()
+        with self._lock:
+            self.urls_done += 1
+            self.last_finished = now
+            for result in scan_results.values():
+                self.probes += 1
+                if not result.request_success:
+                    if isinstance(result.error, str) and result.error.startswith('Skipped'):
+                        self.skipped += 1
+                    else:
+                        self.errors += 1
+                else:
+                    self.status_codes[result.status_code] = self.status_codes.get(result.status_code, 0) + 1
+            self._recent.append((now, self.urls_done, self.probes))
+            # Keep one sample from before the window as its starting point
+            while len(self._recent) > 1 and now - self._recent[1][0] > self.window:
+                self._recent.popleft()
+
+    def snapshot(self):
+        now = time.monotonic()
+        with self._lock:
+            elapsed = now - self.started
+            # Rates since the last sample before the window (or the start),
+            # so they drop to zero while nothing finishes
+            since, urls_before, probes_before = self.started, 0, 0
+            for sample in self._recent:
+                if now - sample[0] <= self.window:
+                    break
+                since, urls_before, probes_before = sample
+            span = max(now - since, 1e-6)
+            url_rate = (self.urls_done - urls_before) / span
+            probe_rate = (self.probes - probes_before) / span
+            attempted = self.probes - self.skipped
+
+            stats = {
+                'urls_done': self.urls_done,
+                'urls_total': self.total,
+                'urls_passed_over': self.passed_over() if self.passed_over != None else 0,
+                'probes': self.probes,
+                'errors': self.errors,
+                'skipped': self.skipped,
+                'error_rate': round(self.errors / attempted, 4) if attempted else 0.0,
+                'urls_per_second': round(url_rate, 2),
+                'requests_per_second': round(probe_rate, 2),
+                'elapsed_seconds': round(elapsed, 1),
+                'seconds_since_progress': round(now - self.last_finished, 1),
+                'status_codes': dict(self.status_codes),
+                'eta_seconds': None,
+            }
+        if self.total != None:
+            remaining = self.total - stats['urls_done'] - stats['urls_passed_over']
+            if remaining <= 0:
+                stats['eta_seconds'] = 0.0
+            elif url_rate > 0:
+                stats['eta_seconds'] = round(remaining / url_rate, 1)
+        return stats
+
+
+def format_duration(seconds):
+    if seconds == None:
+        return '--:--'
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return '{}:{:02d}:{:02d}'.format(seconds // 3600, seconds % 3600 // 60, seconds % 60)
+    return '{:02d}:{:02d}'.format(seconds // 60, seconds % 60)
+
+
+# One line summary of a ScanProgress snapshot
+def progress_line(stats):
+    done = stats['urls_done'] + stats['urls_passed_over']
+    if stats['urls_total'] != None:
+        total = stats['urls_total']
+        count = '{}/{} URLs ({:.1f}%)'.format(done, total, done * 100 / total if total else 100.0)
+    else:
+        count = '{} URLs'.format(done)
+    return '{} | {:.1f} req/s | {:.1f}% errors | elapsed {} | ETA {}'.format(
+        count,
+        stats['requests_per_second'],
+        stats['error_rate'] * 100,
+        format_duration(stats['elapsed_seconds']),
+        format_duration(stats['eta_seconds']) )
+
+
+# Redraws the progress line on stderr at most every `interval` seconds, in
+# place when stderr is a terminal and as plain lines otherwise (so logs of
+# scheduled runs stay readable)
+class ProgressPrinter:
+    def __init__(self, progress, interval=1.0, stream=None):
+        self.progress = progress
+        self.stream = stream or sys.stderr
+        self.tty = self.stream.isatty()
+        self.interval = interval if self.tty else max(interval, 10.0)
+        self.last = 0.0
+        self.width = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    # Redraw the line from a background thread until close(), so it keeps
+    # moving while the scan waits on slow hosts
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='progress', daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.tick()
+
+    def tick(self, force=False):
+        now = time.monotonic()
+        if not force and now - self.last < self.interval:
+            return
+        self.last = now
+        line = progress_line(self.progress.snapshot())
+        if self.tty:
+            self.stream.write('\r' + line.ljust(self.width))
+            self.width = len(line)
+        else:
+            self.stream.write(line + '\n')
+        self.stream.flush()
+
+    # Wipe the line before something else is printed to the terminal
+    def clear(self):
+        if self.tty and self.width:
+            self.stream.write('\r' + ' ' * self.width + '\r')
+            self.stream.flush()
+            self.width = 0
+            self.last = 0.0
+
+    def close(self):
+        if self._thread != None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        self.tick(force=True)
+        if self.tty:
+            self.stream.write('\n')
+            self.stream.flush()
+
+
+# Serves a ScanProgress on a local HTTP port for schedulers and monitoring:
+# /metrics in the Prometheus text format, /metrics.json (or /) as JSON.
+class MetricsServer:
+    prefix = 'urlspy_'
+
+    def __init__(self, progress, host='127.0.0.1', port=0):
+        self.progress = progress
+        metrics = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split('?', 1)[0]
+                if path == '/metrics':
+                    body = metrics.prometheus().encode()
+                    content_type = 'text/plain; version=0.0.4'
+                elif path in ('/', '/metrics.json'):
+                    body = json.dumps(metrics.progress.snapshot()).encode()
+                    content_type = 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.host, self.port = self.server.server_address[:2]
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name='urls-metrics', daemon=True)
+        self._thread.start()
+        return self
+
+    def prometheus(self):
+        stats = self.progress.snapshot()
+        lines = []
+        described = set()
+
+        def metric(name, kind, help, value, labels=''):
+            if value == None:
+                return
+            full = self.prefix + name
+            if full not in described:
+                described.add(full)
+                lines.append('# HELP {} {}'.format(full, help))
+                lines.append('# TYPE {} {}'.format(full, kind))
+            lines.append('{}{} {}'.format(full, labels, value))
+
+        metric('urls_done_total', 'counter', 'URLs scanned', stats['urls_done'])
+        metric('urls_passed_over_total', 'counter', 'URLs dropped without a scan (duplicates, resumed)', stats['urls_passed_over'])
+        metric('urls', 'gauge', 'URLs in the input', stats['urls_total'])
+        metric('probes_total', 'counter', 'Requests made, one per URL and method', stats['probes'])
+        metric('errors_total', 'counter', 'Requests that failed', stats['errors'])
+        metric('skipped_total', 'counter', 'Requests skipped (dead host, budget used up)', stats['skipped'])
+        for code, count in sorted(stats['status_codes'].items()):
+            metric('responses_total', 'counter', 'Responses by status code', count, '{{code="{}"}}'.format(code))
+        metric('requests_per_second', 'gauge', 'Recent request rate', stats['requests_per_second'])
+        metric('urls_per_second', 'gauge', 'Recent URL rate', stats['urls_per_second'])
+        metric('error_ratio', 'gauge', 'Share of requests that failed', stats['error_rate'])
+        metric('elapsed_seconds', 'gauge', 'Seconds since the scan started', stats['elapsed_seconds'])
+        metric('seconds_since_progress', 'gauge', 'Seconds since a URL last finished (stall detection)', stats['seconds_since_progress'])
+        metric('eta_seconds', 'gauge', 'Estimated seconds left', stats['eta_seconds'])
+        return '\n'.join(lines) + '\n'
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+# In-process DNS cache. install() routes socket.getaddrinfo through it, so
+# every probe (urllib3, and aiohttp's default threaded resolver) reuses an
+# answer for `ttl` seconds instead of asking the resolver again; failures are
+# remembered for `negative_ttl`. getaddrinfo does not expose record TTLs, so
+# the configured TTL applies to every host. Answers are cached per host and
+# filtered by family/type on the way out, so one lookup serves every port.
+class DnsCache:
+    def __init__(self, ttl=300.0, negative_ttl=60.0):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.entries = {}    # host -> (expires, addrinfo list or gaierror)
+        self.lookups = 0
+        self.hits = 0
+        self.failed = set()
+        self._lock = threading.Lock()
+        self._getaddrinfo = socket.getaddrinfo
+
+    def install(self):
+        socket.getaddrinfo = self.getaddrinfo
+
+    def uninstall(self):
+        if socket.getaddrinfo == self.getaddrinfo:
+            socket.getaddrinfo = self._getaddrinfo
+
+    def _resolve(self, host):
+        now = time.monotonic()
+        with self._lock:
+            self.lookups += 1
+            entry = self.entries.get(host)
+            if entry != None and entry[0] > now:
+                self.hits += 1
+                answer = entry[1]
+                if isinstance(answer, socket.gaierror):
+                    raise answer
+                return answer
+
+        try:
+            answer = self._getaddrinfo(host, 0, 0, socket.SOCK_STREAM)
+        except socket.gaierror as err:
+            with self._lock:
+                self.entries[host] = (now + self.negative_ttl, err)
+            raise
+        with self._lock:
+            self.entries[host] = (now + self.ttl, answer)
+        return answer
+
+    def getaddrinfo(self, host, port, family=0, type=0, proto=0, flags=0):
+        # Only plain TCP lookups of a name with a numeric port are cached
+        cacheable = (
+            isinstance(host, str)
+            and type in (0, socket.SOCK_STREAM)
+            and not flags & socket.AI_CANONNAME
+            and (port == None or isinstance(port, int) or str(port).isdigit()) )
+        if not cacheable:
+            return self._getaddrinfo(host, port, family, type, proto, flags)
+
+        port = int(port or 0)
+        results = []
+        for af, socktype, prot, canonname, sockaddr in self._resolve(host):
+            if family and af != family:
+                continue
+            if proto and prot != proto:
+                continue
+            results.append((af, socktype, prot, canonname, (sockaddr[0], port) + tuple(sockaddr[2:])))
+        if not results:
+            raise socket.gaierror(socket.EAI_FAMILY, 'No address for {} in the requested family'.format(host))
+        return results
+
+    # Resolve `hosts` in parallel and return the ones that do not resolve
+    def prefetch(self, hosts, workers=32):
+        def resolve(host):
+            try:
+                self._resolve(host)
+                return None
+            except socket.gaierror as err:
+                return host, err
+            except (UnicodeError, ValueError) as err:
+                return host, err
+
+        failed = {}
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='urls-dns') as pool:
+            for item in pool.map(resolve, hosts):
+                if item != None:
+                    failed[item[0]] = item[1]
+        self.failed.update(failed)
+        return failed
+
+
+# Cheap "is anyone there" check run once per origin before its URLs are
+# probed. 'tcp' opens and closes a TCP connection, 'head' sends one HEAD with
+# a short timeout (used behind a proxy, where a direct connect says nothing).
+# A dead origin costs one short timeout instead of a full timeout per method.
+class HostLiveness:
+    def __init__(self, mode='tcp', timeout=3.0):
+        self.mode = mode
+        self.timeout = timeout
+        self.results = {}    # origin -> None (alive) or reason
+        self.dead = 0
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    # (scheme, host, port) of the URL; raises ValueError for an invalid URL
+    def origin(self, url):
+        parts = urlsplit(url)
+        port = parts.port or DEFAULT_PORTS.get(parts.scheme.lower(), 80)
+        return (parts.scheme.lower(), (parts.hostname or '').lower(), port)
+
+    # Returns None when the URL's origin answered, otherwise why it is skipped
+    def check(self, recon, url):
+        try:
+            origin = self.origin(url)
+        except ValueError as err:
+            return 'Skipped: invalid URL ({})'.format(err)
+        host, port = origin[1], origin[2]
+
+        with self._lock:
+            if origin in self.results:
+                return self.results[origin]
+            origin_lock = self._locks.setdefault(origin, threading.Lock())
+
+        # Only one thread checks an origin, the rest wait for its answer
+        with origin_lock:
+            with self._lock:
+                if origin in self.results:
+                    return self.results[origin]
+
+            mode = self.mode
+            if mode == 'tcp' and (recon.use_proxy or recon.proxy_pool != None):
+                mode = 'head'
+            if mode == 'tcp':
+                reason = self._check_tcp(host, port)
+            else:
+                reason = self._check_head(recon, url)
+
+            with self._lock:
+                self.results[origin] = reason
+                self._locks.pop(origin, None)
+                if reason != None:
+                    self.dead += 1
+            return reason
+
+    def _check_tcp(self, host, port):
+        try:
+            sock = socket.create_connection((host, port), timeout=self.timeout)
+            sock.close()
+            return None
+        except OSError as err:
+            return 'Skipped: host liveness pre-check failed (TCP connect to {}:{}: {})'.format(
+                host, port, err or err.__class__.__name__)
+
+    def _check_head(self, recon, url):
+        try:
+            response = recon._get_session().head(
                 url,
-                headers = self.use_headers,
-                proxy = self.use_proxy,
-                data = self.use_data,
-                timeout = self.use_timeout )
-            scan_results['DELETE'] = delete_scan_result
+                verify=False,
+                headers=recon.use_headers,
+                proxies=recon.check_proxies(),
+                timeout=self.timeout,
+                allow_redirects=False)
+            response.close()
+            return None
+        except requests.exceptions.RequestException as err:
+            return 'Skipped: host liveness pre-check failed (HEAD {}: {})'.format(url, err)
+
+
+# Path with its variable-looking segments (any digit, or very long) replaced
+# by '*', so /users/17/edit and /users/42/edit count as the same endpoint
+def path_pattern(url):
+    try:
+        path = urlsplit(url).path or '/'
+    except ValueError:
+        return '/'
+    segments = []
+    for segment in path.split('/'):
+        if len(segment) > 32 or any(ch.isdigit() for ch in segment):
+            segment = '*'
+        segments.append(segment)
+    return '/'.join(segments)
+
+
+# Which methods servers have said they do not support, for adaptive method
+# skipping. allow_reasons() reads the Allow header of a URL's OPTIONS answer;
+# learn() counts 405/501 answers per host and per path pattern. A method
+# rejected `evidence` times for a path pattern (three times that for a whole
+# host) and never accepted there is skipped for further URLs it covers, but
+# sent anyway every `reprobe` URLs so a server that starts accepting it is
+# noticed. Counts are kept for the `max_keys` most recently seen hosts and
+# path patterns.
+class MethodLearner:
+    rejected_codes = (405, 501)
+
+    def __init__(self, evidence=3, reprobe=50, max_keys=65536):
+        self.evidence = evidence
+        self.reprobe = reprobe
+        self.max_keys = max_keys
+        # (host, pattern or None) -> {method: [rejected, accepted, skipped]}
+        self.counts = OrderedDict()
+        self.skipped_allow = 0
+        self.skipped_learned = 0
+        self.reprobed = 0
+        self._lock = threading.Lock()
+
+    def _keys(self, url):
+        host = url_host(url)
+        return [((host, path_pattern(url)), self.evidence), ((host, None), self.evidence * 3)]
+
+    # Counts for `key`, marked as recently used. Created when `create` is set,
+    # dropping the least recently used key when there are too many.
+    def _counts(self, key, create=False):
+        counts = self.counts.get(key)
+        if counts != None:
+            self.counts.move_to_end(key)
+        elif create:
+            counts = self.counts[key] = {}
+            if len(self.counts) > self.max_keys:
+                self.counts.popitem(last=False)
+        return counts
 
+    # method -> reason for methods learned to be rejected
+    def skip_reasons(self, url, methods):
+        reasons = {}
+        with self._lock:
+            keys = [(key, needed, self._counts(key) or {}) for key, needed in self._keys(url)]
+            for method in methods:
+                for key, needed, counts in keys:
+                    entry = counts.get(method)
+                    if entry == None or entry[0] < needed or entry[1] > 0:
+                        continue
+                    entry[2] += 1
+                    if self.reprobe > 0 and entry[2] % self.reprobe == 0:
+                        # Sent this time to see whether it is still refused
+                        self.reprobed += 1
+                    else:
+                        reasons[method] = 'Skipped: {} was refused (405/501) on {} earlier URLs {}'.format(
+                            method, entry[0],
+                            'like {}{}'.format(key[0], key[1]) if key[1] != None else 'of {}'.format(key[0]) )
+                    break
+            self.skipped_learned += len(reasons)
+        return reasons
+
+    # method -> reason for methods left out of the Allow header of a
+    # successful OPTIONS answer. HEAD is taken as allowed along with GET.
+    def allow_reasons(self, result, headers, methods):
+        if not result.request_success or result.status_code >= 400 or headers == None:
+            return {}
+        allow = headers.get('Allow')
+        if not allow:
+            return {}
+        allowed = set(m.strip().upper() for m in allow.split(',') if m.strip())
+        if 'GET' in allowed:
+            allowed.add('HEAD')
+        reasons = {}
+        for method in methods:
+            if method != 'OPTIONS' and method not in allowed:
+                reasons[method] = 'Skipped: {} is not in the Allow header of OPTIONS ({})'.format(method, allow)
+        with self._lock:
+            self.skipped_allow += len(reasons)
+        return reasons
+
+    def learn(self, url, scan_results):
+        keys = [key for key, _ in self._keys(url)]
+        with self._lock:
+            for method, result in scan_results.items():
+                if not result.request_success:
+                    continue
+                refused = result.status_code in self.rejected_codes
+                for key in keys:
+                    counts = self._counts(key, create=True).setdefault(method, [0, 0, 0])
+                    counts[0 if refused else 1] += 1
+
+
+# Body chunks of a streamed requests response. With `partial`, each chunk is
+# whatever one socket read returned instead of a full chunk_size, so the
+# caller gets control back between reads of a slow body.
+def iter_body(response, partial=False):
+    read1 = getattr(response.raw, 'read1', None)
+    if not partial or read1 == None:
+        yield from response.iter_content(BodyCapture.chunk_size)
+        return
+    while True:
+        chunk = read1(BodyCapture.chunk_size, decode_content=True)
+        if not chunk:
+            break
+        yield chunk
+
+# Lower a requests-style timeout (a number or a (connect, read) pair) so it
+# does not go past `remaining` seconds
+def clip_timeout(timeout, remaining):
+    if isinstance(timeout, tuple):
+        return tuple(min(t, remaining) if t != None else remaining for t in timeout)
+    if timeout == None:
+        return remaining
+    return min(timeout, remaining)
+
+
+# Host part of a URL, used to group URLs that hit the same server
+def url_host(url):
+    try:
+        return (urlsplit(url).hostname or '').lower()
+    except ValueError:
+        return ''
+
+
+# Scan a list of URLs and yield (index, url, scan_results, duration) in input
+# order. With more than one worker the URLs go through a bounded thread pool:
+# at most `workers` URLs are scanned at once, at most `per_host` of them
+# against the same host (0 for no cap), and no more than `window` URLs are read
+# ahead of the oldest unfinished one so memory stays flat on huge lists.
+def scan_urls(recon, urls, except_: list=[], workers=1, per_host=0, window=0):
+    if isinstance(recon, AsyncEndpointRecon):
+        yield from recon.scan_urls(urls, except_=except_, per_host=per_host, window=window)
+        return
+
+    if workers <= 1:
+        for index, url in enumerate(urls):
+            res, duration = recon.begin(url, except_=except_)
+            yield index, url, res, duration
+        return
+
+    window = window or workers * 8
+    url_iter = enumerate(urls)
+    exhausted = False
+    waiting = {}     # host -> deque of (index, url) held back by the host cap
+    n_waiting = 0
+    active = {}      # host -> number of URLs being scanned
+    running = {}     # future -> (index, url, host)
+    finished = {}    # index -> (url, scan_results, duration)
+    next_index = 0
+
+    def host_free(host):
+        return per_host <= 0 or active.get(host, 0) < per_host
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='urls-scan') as pool:
+
+        def start(index, url, host):
+            active[host] = active.get(host, 0) + 1
+            future = pool.submit(recon.begin, url, except_)
+            running[future] = (index, url, host)
+
+        while True:
+            # Hand held back URLs to free workers, oldest first
+            while n_waiting and len(running) < workers:
+                ready = [h for h in waiting if host_free(h)]
+                if not ready:
+                    break
+                host = min(ready, key=lambda h: waiting[h][0][0])
+                index, url = waiting[host].popleft()
+                if not waiting[host]:
+                    del waiting[host]
+                n_waiting -= 1
+                start(index, url, host)
+
+            # Read ahead while the window has room
+            while not exhausted and len(running) + n_waiting + len(finished) < window:
+                try:
+                    index, url = next(url_iter)
+                except StopIteration:
+                    exhausted = True
+                    break
+                host = url_host(url)
+                if len(running) < workers and host_free(host) and host not in waiting:
+                    start(index, url, host)
+                else:
+                    waiting.setdefault(host, deque()).append((index, url))
+                    n_waiting += 1
+
+            if not running:
+                break
+
+            done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in done:
+                index, url, host = running.pop(future)
+                active[host] -= 1
+                if not active[host]:
+                    del active[host]
+                res, duration = future.result()
+                finished[index] = (url, res, duration)
+
+            while next_index in finished:
+                url, res, duration = finished.pop(next_index)
+                yield next_index, url, res, duration
+                next_index += 1
+
+
+# Colored terminal output for one URL, as text
+def format_result(c, url, duration, res, max_content_size=-1, changes={}):
+    lines = []
+    lines.append('{}URL:{} {}{}{}'.format(c.cyan,c.reset,c.yellow,url,c.reset))
+    lines.append('{}Duration:{} {}{}{} seconds'.format(c.cyan,c.reset,c.yellow,str(duration),c.reset))
+    lines.append(' \n')
+
+    first_with_body = {}
+    for k in list(res.keys()):
+        
+        lines.append(' {}Request Method:{} {}{}{}'.format(
+            c.cyan, c.reset, c.green, k, c.reset ) )
+
+        if k in changes:
+            lines.append('  {}Change:{} {}{}{}'.format(
+                c.cyan, c.reset, c.red, changes[k], c.reset ) )
+
+        lines.append('  {}Request Completed:{} {}{}{}'.format(
+            c.cyan, c.reset, c.yellow, res[k].request_success, c.reset ) )
+        
+        lines.append('  {}Status:{} {}{}{} ({})'.format(
+            c.cyan, c.reset, c.yellow, res[k].status_code, c.reset,
+            STATUS_CODES[res[k].status_code] if res[k].status_code in list(STATUS_CODES.keys()) else 'Unknown' ) )
+        
+        lines.append('  {}Response Content Type:{} {}{}{}'.format(
+            c.cyan, c.reset, c.yellow, res[k].response_content_type, c.reset ) )
+
+        lines.append('  {}Response Size:{} {}Approx. {}{}{} Bytes{}'.format(
+            c.cyan, c.reset, c.white, c.yellow, res[k].response_size, c.white, c.reset ) )
+
+        if res[k].body_hash != None:
+            # Point out bodies identical to one already shown for this URL
+            same = first_with_body.setdefault(res[k].body_hash, k)
+            lines.append('  {}Body Hash:{} {}{}{}{}'.format(
+                c.cyan, c.reset, c.yellow, res[k].body_hash.hex(), c.reset,
+                ' (same body as {})'.format(same) if same != k else '' ) )
+
+        timings = res[k].timings
+        if timings != None and any(t != None for t in timings):
+            lines.append('  {}Timings:{} {}{}{}'.format(
+                c.cyan, c.reset, c.yellow,
+                ', '.join('{} {:.1f} ms'.format(phase, t * 1000) for phase, t in zip(PHASES, timings) if t != None),
+                c.reset ) )
+
+        lines.append('  {}Content:{}{}\n'.format(
+            c.cyan, c.reset,
+            res[k].content_prefix(max_content_size) or 'Not Available' ) )
+        
+        lines.append(' \n')
 
-        # === [ Arbitrary ] ===
+        if res[k].error != None:
+            lines.append('Error: {}{}{}'.format(c.red,res[k].error,c.reset))
+    return '\n'.join(lines) + '\n'
+
+TABLE_COLUMN = 8
+
+# Header of the summary table: one column per scanned method, then the URL
+def format_table_header(c, methods):
+    return '{}{}{:>8} URL{}\n'.format(
+        c.cyan, ''.join(m.ljust(TABLE_COLUMN) for m in methods), 'Seconds', c.reset )
+
+# One summary table line for a URL: the status code of each method ('err'
+# for a failed request, 'skip' for a skipped one, '.' when not reported
+# because it did not change since the baseline), a '*' on changed results
+def format_table_row(c, url, duration, res, methods, changes={}):
+    cells = []
+    for method in methods:
+        result = res.get(method)
+        if result == None:
+            cell, color = '.', c.white
+        elif result.request_success:
+            code = result.status_code
+            cell = str(code)
+            color = c.green if code < 300 else c.cyan if code < 400 else c.yellow if code < 500 else c.red
+        elif isinstance(result.error, str) and result.error.startswith('Skipped'):
+            cell, color = 'skip', c.white
+        else:
+            cell, color = 'err', c.red
+        if method in changes:
+            cell += '*'
+        cells.append('{}{}{}'.format(color, cell.ljust(TABLE_COLUMN), c.reset))
+    return '{}{:>8.2f} {}{}{}\n'.format(''.join(cells), duration, c.yellow, url, c.reset)
+
+
+# Writes scan results to the terminal from a background thread, so the scan
+# loop never waits on stdout. Results are formatted as they are submitted and
+# only their text is queued, so nothing holds on to bodies; whatever is queued
+# is written in one go, and the progress line is redrawn from the same thread.
+# When more than `max_pending` results or `max_bytes` of text are still
+# waiting, a result is queued as its table line instead.
+class TerminalRenderer:
+    def __init__(self, c, max_content_size=-1, table=False, methods=METHODS, printer=None,
+                 max_pending=1000, max_bytes=64 * 1024 * 1024, stream=None):
+        self.c = c
+        self.max_content_size = max_content_size
+        self.table = table
+        self.methods = methods
+        self.printer = printer
+        self.max_pending = max_pending
+        self.max_bytes = max_bytes
+        self.stream = stream or sys.stdout
+        self.queue = queue.Queue()
+        self.condensed = 0
+        self.pending_bytes = 0
+        self.lock = threading.Lock()
+        if table:
+            self.queue.put(format_table_header(c, methods))
+        self.thread = threading.Thread(target=self._run, name='renderer', daemon=True)
+        self.thread.start()
+
+    def submit(self, url, duration, res, changes={}):
+        if self.table:
+            self.queue.put(format_table_row(self.c, url, duration, res, self.methods, changes))
+            return
+        text = format_result(self.c, url, duration, res, self.max_content_size, changes)
+        with self.lock:
+            fits = self.queue.qsize() < self.max_pending and self.pending_bytes + len(text) <= self.max_bytes
+            if fits:
+                self.pending_bytes += len(text)
+        if fits:
+            self.queue.put((text,))
+        else:
+            self.condensed += 1
+            self.queue.put(format_table_row(self.c, url, duration, res, self.methods, changes))
+
+    # A line of plain text, kept in order with the results
+    def note(self, text):
+        self.queue.put(text + '\n')
+
+    def _format(self, item):
+        if isinstance(item, str):
+            return item
+        # Result text, counted in pending_bytes
+        text, = item
+        with self.lock:
+            self.pending_bytes -= len(text)
+        return text
+
+    def _run(self):
+        timeout = self.printer.interval if self.printer != None else None
+        while True:
+            try:
+                batch = [self.queue.get(timeout=timeout)]
+            except queue.Empty:
+                self.printer.tick()
+                continue
+            while len(batch) < 256:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            text = ''.join(self._format(item) for item in batch if item != None)
+            if text:
+                if self.printer != None:
+                    self.printer.clear()
+                self.stream.write(text)
+                self.stream.flush()
+            if self.printer != None:
+                self.printer.tick()
+            if None in batch:
+                return
+
+    # Writes out everything still queued
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        if self.printer != None:
+            self.printer.close()
+
+# MAIN
+def main(args: list):
+    urls = []
+    except_=[]
+    output = None
+    output_format = None
+    max_content_size = -1
+    workers = 1
+    host_limit = 0
+    c = Color()
+
+    # Merge the outputs of earlier scans instead of scanning
+    if args.merge != None:
+        if args.output == None:
+            print('{}Error: --merge needs an --output file to write to{}'.format(c.red,c.reset))
+            return -1
+        output_format = args.output_format or 'json'
+        try:
+            counts = merge_outputs(args.merge, args.output, output_format)
+        except (OSError, ValueError) as err:
+            print('{}Error while merging: {}{}'.format(c.red,err,c.reset))
+            return -1
+        for path, count in counts.items():
+            print('{}Merged:{} {}{}{} rows from {}'.format(c.cyan, c.reset, c.yellow, count, c.reset, path))
+        print("Results saved to {} as select format: \'{}\'.".format(args.output,output_format.upper()))
+        return 0
+
+    # Pick the scanning engine
+    try:
+        if args.engine != None and args.engine.lower() == 'async':
+            recon = AsyncEndpointRecon()
+        else:
+            recon = EndpointRecon()
+    except RuntimeError as err:
+        print('{}Error: {}{}'.format(c.red,err,c.reset))
+        return -1
+
+    
+    print(logo)
+
+    # Select URL from args
+    if args.url != None:
+        urls.append(args.url)
+    # Or a file of URLs, read as the scan goes
+    elif args.url_file != None:
+        url_file = UrlFile(str(args.url_file))
+        try:
+            url_file.check()
+        except Exception as err:
+            print("{}Error while reading from URL file: \'{}\'{}".format(c.red,args.url_file,c.reset))
+            print(err)
+            return -1
+        urls = url_file
+    # But its required :c
+    else:
+        print('Error: URL is required.')
+        print('Use \'--help\' or \'-h\' to see the help menu.')
+        return -1
+
+    # Or the paths of a wordlist under each of them
+    expander = None
+    if args.wordlist != None:
+        if args.wordlist == '-' and args.url == None and args.url_file == '-':
+            print('{}Error: the URL file and the wordlist cannot both be STDIN{}'.format(c.red,c.reset))
+            return -1
+        words = WordFile(str(args.wordlist))
+        try:
+            words.check()
+        except Exception as err:
+            print("{}Error while reading from wordlist: \'{}\'{}".format(c.red,args.wordlist,c.reset))
+            print(err)
+            return -1
+        expander = PathExpander(urls, words, evidence=args.wildcard_evidence)
+        urls = expander
+        print('{}Expanding:{} {}{}{} base URLs with the paths in {}'.format(
+            c.cyan, c.reset, c.yellow, len(expander.bases), c.reset, args.wordlist ) )
+    
+    # Only this node's share of the hosts
+    shard = None
+    if args.shard != None:
+        try:
+            shard = HostShard.parse(args.shard)
+        except ValueError as err:
+            print('{}Error: {}{}'.format(c.red,err,c.reset))
+            return -1
+
+    progress = ScanProgress(total=len(urls) if isinstance(urls, list) else None)
+    if progress.total == None and (args.progress or args.metrics_port != None) and urls.rereadable:
+        # Count the URLs on the side so the scan does not wait for it
+        def count_urls():
+            progress.total = urls.count()
+        threading.Thread(target=count_urls, name='urls-count', daemon=True).start()
+
+    # Select Proxy from args
+    if args.proxy != None:
+        recon.use_proxy = {
+            'http': str(args.proxy),
+            'https': str(args.proxy)}
+
+    # Or spread requests over a pool of proxies
+    if args.proxy_pool != None:
+        try:
+            pool_options = {
+                'strategy': args.proxy_strategy,
+                'max_failures': max(1, args.proxy_max_failures),
+                'eject_seconds': args.proxy_eject }
+            if os.path.exists(args.proxy_pool):
+                recon.proxy_pool = ProxyPool.from_file(args.proxy_pool, **pool_options)
+            else:
+                recon.proxy_pool = ProxyPool(
+                    [p.strip() for p in args.proxy_pool.split(',') if p.strip()], **pool_options)
+        except (OSError, ValueError) as err:
+            print('{}Error while loading proxy pool: {}{}'.format(c.red,err,c.reset))
+            return -1
+        
+    # Select method exceptions
+    if args.exclude != None:
+        except_ = [e.strip().upper() for e in str(args.exclude).split(',')]
+    
+    if args.timeout != None:
+        recon.use_timeout = int(args.timeout)
+
+    if args.connect_timeout != None:
+        recon.connect_timeout = args.connect_timeout
+
+    if args.read_timeout != None:
+        recon.read_timeout = args.read_timeout
+
+    if args.request_deadline != None:
+        recon.request_deadline = args.request_deadline
+
+    if args.url_budget != None:
+        recon.url_budget = args.url_budget
+
+    if args.concurrent:
+        recon.concurrent = True
+
+    if args.workers != None:
+        workers = max(1, int(args.workers))
+        # Room for every method of every worker's URL when both are on
+        recon.method_workers = workers * len(METHODS)
+
+    if args.host_limit != None:
+        host_limit = max(0, int(args.host_limit))
+
+    if args.precheck != None:
+        recon.liveness = HostLiveness(mode=args.precheck, timeout=args.precheck_timeout)
+
+    if args.adaptive_methods:
+        recon.method_learner = MethodLearner(evidence=max(1, args.adaptive_evidence))
+
+    if args.rate != None or args.backoff:
+        recon.rate_limiter = HostRateLimiter(
+            rate=args.rate or 0,
+            burst=args.burst or 0,
+            max_backoff=args.max_backoff )
+        recon.max_retries = max(0, args.max_retries)
+
+    if args.pool_size != None:
+        recon.pool_size = max(1, int(args.pool_size))
+    elif recon.concurrent:
+        # Room for every method of every URL a host may have in flight
+        recon.pool_size = max(recon.pool_size, max(1, host_limit) * len(METHODS))
+
+    if args.max_inflight != None and isinstance(recon, AsyncEndpointRecon):
+        recon.max_inflight = max(1, int(args.max_inflight))
+    
+    if args.output != None:
+        output = args.output
+
+        if args.output_format != None:
+            output_format = args.output_format
+        else:
+            output_format = 'json'
+    
+    if args.shrink_content != None:
+        if str(args.shrink_content).lower() == 'none':
+            max_content_size = -1
+        else:
+            max_content_size = int(args.shrink_content)
+
+    if args.stream_content and max_content_size != -1:
+        recon.capture_limit = max_content_size
+
+    if args.drain_limit != None:
+        recon.drain_limit = max(0, int(args.drain_limit))
+    
+
+    # Everything opened from here on is closed in the finally block below,
+    # also when setting up fails or the scan is interrupted
+    dns = None
+    journal = None
+    printer = None
+    metrics = None
+    writer = None
+    body_table = None
+    renderer = None
+    try:
+        # Cache DNS answers, and optionally resolve every host before scanning
+        if args.dns_cache or args.resolve_first:
+            dns = DnsCache(ttl=args.dns_ttl)
+            dns.install()
+
+        if args.resolve_first:
+            if recon.use_proxy or recon.proxy_pool != None:
+                # The proxy resolves names, local answers say nothing about them
+                print('{}Skipping DNS pre-resolution: requests go through a proxy{}'.format(c.yellow,c.reset))
+            else:
+                if expander != None:
+                    # Every expanded URL is on the host of its base
+                    targets = expander.bases
+                else:
+                    if not isinstance(urls, list) and not urls.rereadable:
+                        # Standard input or a pipe can only be read once
+                        urls = list(urls)
+                    targets = urls
+                hosts = set(url_host(url) for url in targets if shard == None or shard.owns(url))
+                hosts.discard('')
+                failed = dns.prefetch(hosts, workers=args.dns_workers)
+                for host, err in failed.items():
+                    recon.skip_hosts[host] = 'Skipped: DNS resolution failed for {} ({})'.format(host, err)
+                print('{}Resolved:{} {}{}{} hosts, {}{}{} failed (their URLs are skipped)'.format(
+                    c.cyan, c.reset, c.yellow, len(hosts) - len(failed), c.reset,
+                    c.yellow, len(failed), c.reset ) )
+
+        if shard != None:
+            urls = shard.filter(urls)
+
+        # Drop duplicate URLs before they cost any requests
+        dedup = None
+        if args.dedup or args.dedup_bloom != None:
+            dedup = UrlDedup(bloom_capacity=args.dedup_bloom or 0)
+            urls = dedup.filter(urls)
+
+        # Skip URLs a previous run already finished
+        if args.resume != None:
+            journal = ScanJournal(args.resume)
+            try:
+                journal.load()
+            except OSError as err:
+                print("{}Error while reading from journal: \'{}\'{}".format(c.red,args.resume,c.reset))
+                print(err)
+                return -1
+            urls = journal.pending(urls, [m for m in METHODS if m not in except_])
+
+        # Input URLs dropped before scanning still count as progress
+        progress.passed_over = lambda: (
+            (dedup.duplicates if dedup != None else 0) + (journal.skipped if journal != None else 0) +
+            (shard.others if shard != None else 0) + (expander.pruned if expander != None else 0))
+
+        if args.metrics_port != None:
+            try:
+                metrics = MetricsServer(progress, host=args.metrics_host, port=args.metrics_port).start()
+            except OSError as err:
+                print('{}Error while starting the metrics endpoint on {}:{}{}'.format(c.red,args.metrics_host,args.metrics_port,c.reset))
+                print(err)
+                return -1
+            print('{}Metrics:{} http://{}:{}/metrics (JSON at /metrics.json)'.format(
+                c.cyan, c.reset, metrics.host, metrics.port ) )
+
+        # Compare against earlier scans and only report what changed
+        baseline = None
+        if args.baseline != None:
+            baseline = Baseline()
+            try:
+                for path in args.baseline:
+                    baseline.load(path)
+            except (OSError, ValueError) as err:
+                print("{}Error while reading baseline: {}{}".format(c.red,err,c.reset))
+                return -1
+            recon.baseline = baseline
+            print('{}Baseline:{} {}{}{} earlier results loaded'.format(
+                c.cyan, c.reset, c.yellow, len(baseline.entries), c.reset ) )
+
+        # Results are written as each URL finishes
+        if output != None and output_format != None:
+            try:
+                options = {}
+                if journal != None:
+                    # Rows must be on disk before the journal says they are done
+                    options['batch_rows'] = 0
+                    options['resume_at'] = journal.output_position
+                writer = open_writer(
+                    output,
+                    output_format,
+                    max_content_size,
+                    append=journal != None,
+                    content=args.body_table == None,
+                    **options )
+                if args.body_table != None:
+                    body_table = BodyTable(args.body_table, max_content_size, append=journal != None)
+            except (OSError, ValueError) as err:
+                print('{}Error while opening output file: \'{}\'{}'.format(c.red,output,c.reset))
+                print(err)
+                return -1
+
+        if args.progress:
+            printer = ProgressPrinter(progress)
+
+        # Without an output file results go to the terminal, written from a
+        # background thread that also takes over the progress line
+        if output == None and output_format == None:
+            renderer = TerminalRenderer(
+                c,
+                max_content_size,
+                table=args.table,
+                methods=[m for m in METHODS if m not in except_],
+                printer=printer )
+            printer = None
+        elif printer != None:
+            printer.start()
+
+        # Run analysis
+        phase_stats = PhaseStats()
+        for index, url, res, duration in scan_urls(
+                recon,
+                urls,
+                except_=except_,
+                workers=workers,
+                per_host=host_limit ):
+
+            phase_stats.add(res)
+            progress.update(res)
+            # Only the journal sees every result
+            all_results = res
+            if expander != None:
+                expander.learn(url, all_results)
+            changes = {}
+            if baseline != None:
+                changes = baseline.changes(url, res)
+                res = {m: res[m] for m in changes}
+
+            if writer != None and res:
+                writer.write(url, res, changes)
+            if body_table != None:
+                body_table.write(url, res)
+            # Only after the results are safely written
+            if journal != None:
+                journal.record(url, all_results, writer.position() if writer != None else None)
+
+            if renderer != None and res:
+                renderer.submit(url, duration, res, changes)
+
+        # What the baseline has that this scan did not see again. Not known
+        # when resuming: URLs finished by the earlier run were not scanned now.
+        if baseline != None and journal == None:
+            removed = baseline.removed_rows(
+                [m for m in METHODS if m not in except_],
+                shard.owns if shard != None else None )
+            for row in removed:
+                if writer != None:
+                    writer.write_rows([row])
+                elif renderer != None:
+                    renderer.note('{}Removed:{} {} {}'.format(c.red, c.reset, row['Method'], row['Url']))
+    finally:
+        if writer != None:
+            writer.close()
+        if body_table != None:
+            body_table.close()
+        if journal != None:
+            journal.close()
+        if printer != None:
+            printer.close()
+        if renderer != None:
+            renderer.close()
+        if metrics != None:
+            metrics.close()
+        # Also on an error or Ctrl+C: the DNS cache patches socket.getaddrinfo
+        # for the whole process
+        sent, opened = recon.connection_stats()
+        recon.close()
+        if dns != None:
+            dns.uninstall()
+
+    print('{}Connections:{} {}{}{} opened for {}{}{} requests ({} reused)'.format(
+        c.cyan, c.reset, c.yellow, opened, c.reset, c.yellow, sent, c.reset, max(0, sent - opened) ) )
+
+    if any(phase_stats.counts.values()):
+        print('{}Timings:{} ms per phase (probes, mean, p50, p95, p99, max)'.format(c.cyan, c.reset))
+        for phase in PHASES:
+            if not phase_stats.counts[phase]:
+                continue
+            print('  {}{:<8}{} {:>8} {}{:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f}{}'.format(
+                c.cyan, phase, c.reset, phase_stats.counts[phase], c.yellow,
+                phase_stats.mean(phase) * 1000,
+                phase_stats.percentile(phase, 0.50) * 1000,
+                phase_stats.percentile(phase, 0.95) * 1000,
+                phase_stats.percentile(phase, 0.99) * 1000,
+                phase_stats.maxima[phase] * 1000,
+                c.reset ) )
+
+    if recon.body_store != None and recon.body_store.hits:
+        print('{}Bodies:{} {}{}{} responses repeated an earlier body ({:.1f} MB held once instead)'.format(
+            c.cyan, c.reset, c.yellow, recon.body_store.hits, c.reset,
+            recon.body_store.saved_bytes / 1024 / 1024 ) )
+        for digest, count, size in recon.body_store.most_common():
+            print('  {}{}{} {} bytes, seen {} times'.format(c.yellow, digest.hex(), c.reset, size, count))
+
+    if body_table != None:
+        print('{}Body table:{} {}{}{} unique bodies in {}'.format(
+            c.cyan, c.reset, c.yellow, len(body_table.seen), c.reset, args.body_table ) )
+
+    if dns != None:
+        print('{}DNS cache:{} {}{}{} of {} lookups answered from cache'.format(
+            c.cyan, c.reset, c.yellow, dns.hits, c.reset, dns.lookups ) )
+
+    if recon.liveness != None:
+        print('{}Pre-check:{} {}{}{} of {} origins did not answer and were skipped'.format(
+            c.cyan, c.reset, c.yellow, recon.liveness.dead, c.reset, len(recon.liveness.results) ) )
+
+    if recon.method_learner != None:
+        print('{}Adaptive:{} {}{}{} probes skipped ({} not in an Allow header, {} learned from 405/501 answers, {} sent again to recheck)'.format(
+            c.cyan, c.reset, c.yellow,
+            recon.method_learner.skipped_allow + recon.method_learner.skipped_learned, c.reset,
+            recon.method_learner.skipped_allow, recon.method_learner.skipped_learned,
+            recon.method_learner.reprobed ) )
+
+    if recon.proxy_pool != None:
+        print('{}Proxies:{} {}{}{} ejections ({} strategy)'.format(
+            c.cyan, c.reset, c.yellow, recon.proxy_pool.ejected, c.reset, recon.proxy_pool.strategy ) )
+        for proxy, sent, failures, latency, ejected in recon.proxy_pool.summary():
+            print('  {}{}{} {} requests, {} failed, {} average{}'.format(
+                c.yellow, proxy, c.reset, sent, failures,
+                '{:.0f} ms'.format(latency * 1000) if latency != None else 'no',
+                ', ejected' if ejected else '' ) )
+
+    if recon.rate_limiter != None:
+        print('{}Throttled:{} {}{}{} responses asked to slow down, {:.1f} seconds spent waiting'.format(
+            c.cyan, c.reset, c.yellow, recon.rate_limiter.throttled, c.reset, recon.rate_limiter.waited ) )
+
+    if dedup != None:
+        print('{}Deduplicated:{} {}{}{} duplicate URLs dropped ({} probes saved)'.format(
+            c.cyan, c.reset, c.yellow, dedup.duplicates, c.reset,
+            dedup.duplicates * len([m for m in METHODS if m not in except_]) ) )
+
+    if baseline != None:
+        print('{}Changed:{} {}{}{} of {} results ({} answered 304 Not Modified, {} removed)'.format(
+            c.cyan, c.reset, c.yellow, baseline.changed, c.reset, baseline.compared,
+            baseline.not_modified, baseline.removed ) )
+
+    if shard != None:
+        print('{}Shard:{} {}{}/{}{} ({} URLs of other shards\' hosts left out)'.format(
+            c.cyan, c.reset, c.yellow, shard.index + 1, shard.count, c.reset, shard.others ) )
+
+    if expander != None and expander.pruned_bases:
+        print('{}Pruned:{} {}{}{} base URLs answered every path the same way ({} URLs skipped)'.format(
+            c.cyan, c.reset, c.yellow, len(expander.pruned_bases), c.reset, expander.pruned ) )
+        for base in list(expander.pruned_bases)[:5]:
+            print('  {}{}{}'.format(c.yellow, base, c.reset))
+
+    if journal != None:
+        print('{}Resumed:{} {}{}{} URLs skipped as already scanned'.format(
+            c.cyan, c.reset, c.yellow, journal.skipped, c.reset ) )
+
+    if renderer != None and renderer.condensed:
+        print('{}Condensed:{} {}{}{} results shown as one line because the terminal fell behind'.format(
+            c.cyan, c.reset, c.yellow, renderer.condensed, c.reset ) )
+
+    if output != None and output_format != None:
+        print("Results saved to {} as select format: \'{}\'.".format(output,output_format.upper()))
+        
+
+# Command line options, shared with bench.py
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='URL Spy',
+        formatter_class=argparse.RawTextHelpFormatter,
+        description=textwrap.dedent(f'''
+
+                       {logo}
+                Quickly check the availability of mulitple HTTP request methods of a URL
+                and discover necessary information for further analysis.
+            
+        '''),
+        epilog=textwrap.dedent('''\
+            Find on GitHub: https://github.com/CyberJosie/URLs.py
+        ''')
+    )
+
+    parser.add_argument('--url', '-u',
+        action='store',
+        type=str,
+        help=textwrap.dedent('''
+        URL (host and endpoint together) to investigate.
+        Default: None
+        Required: True\n
+        ''')
+    )
+
+    parser.add_argument('--url-file', '-uf',
+        action='store',
+        type=str,
+        help=textwrap.dedent('''
+        Path to file of URLs to analyze. (URLs are newline separated).
+        Read as the scan goes, may be gzip compressed. Use '-' for STDIN.
+        Default: None
+        Required: True (If a single URL is not given)\n
+        ''')
+    )
+
+    parser.add_argument('--wordlist', '-wl',
+        action='store',
+        type=str,
+        help=textwrap.dedent('''
+        Path to a file of paths (newline separated) to try under every given
+        URL, generated as the scan goes. May be gzip compressed, '-' for STDIN.
+        Default: None
+        Required: False\n
+        ''')
+    )
+
+    parser.add_argument('--wildcard-evidence',
+        action='store',
+        type=int,
+        default=5,
+        help=textwrap.dedent('''
+        With --wordlist, stop trying paths on a base URL once this many of its
+        paths got the same answer (not a 404/410). Use '0' to try every path.
+        Default: 5
+        Required: False\n
+        ''')
+    )
+
+    parser.add_argument('--shard', '-sh',
+        action='store',
+        type=str,
+        help=textwrap.dedent('''
+        Scan only shard i of N (e.g. 2/8) to split one URL list over N machines.
+        URLs are split by a consistent hash of their host, so every URL of a
+        host is scanned by the same machine. Combine the outputs with --merge.
+        Default: None
+        Required: False\n
+        ''')
+    )
+
+    parser.add_argument('--baseline', '-bl',
+        action='store',
+        type=str,
+        nargs='+',
+        help=textwrap.dedent('''
+        Output files of earlier scans (JSON, JSONL or CSV) to compare against.
+        GET/HEAD probes are sent as conditional requests where the baseline
+        has an ETag or Last-Modified, and only new, changed and removed
+        results are output, with a Change column saying how. Later files win,
+        so pass the first full scan followed by each run's changes.
+        Default: None
+        Required: False\n
+        ''')
+    )
+
+    parser.add_argument('--merge', '-M',
+        action='store',
+        type=str,
+        nargs='+',
+        help=textwrap.dedent('''
+        Instead of scanning, combine these output files (JSON, JSONL or CSV,
+        mixed formats allowed) into --output in --output-format.
+        Default: None
+        Required: False\n
+        ''')
+    )
+
+    parser.add_argument('--dedup', '-dd',
+        action='store_true',
+        help=textwrap.dedent('''
+        Skip URLs that are the same after normalization (host case, default
+        ports, trailing slashes, query parameter order, fragments).
+        Default: False
+        Required: False\n
+        ''')
+    )
+
+    parser.add_argument('--dedup-bloom', '-db',
+        action='store',
+        type=int,
+        help=textwrap.dedent('''
+        Deduplicate with a Bloom filter sized for this many URLs instead of
+        an exact set. Uses far less memory on huge lists but may drop about
+        1 in 1000 unique URLs as false duplicates. Implies --dedup.
+        Default: None
+        Required: False\n
+        ''')
+    )
+
+    parser.add_argument('--timeout', '-t',
+        action='store',
+        type=int,
+        help=textwrap.dedent('''
+        Max seconds to wait for each server response
+        Default: 10
+        Required: False\n
+        ''')        
+    )
+
+    parser.add_argument('--connect-timeout', '-ct',
+        action='store',
+        type=float,
+        help=textwrap.dedent('''
+        Max seconds to wait for a connection to be set up
+        Default: Same as --timeout
+        Required: False\n
+        ''')
+    )
+
+    parser.add_argument('--read-timeout', '-rt',
+        action='store',
+        type=float,
+        help=textwrap.dedent('''
+        Max seconds to wait between bytes from the server
+        Default: Same as --timeout
+        Required: False\n
+        ''')
+    )
+
+    parser.add_argument('--request-deadline', '-rd',
+        action='store',
+        type=float,
+        help=textwrap.dedent('''
+        Max seconds for one request from start to last body byte, so a server
+        dripping its body slowly cannot hold a probe. Bodies are cut off at
+        the deadline. (With the threads engine a drip of response headers is
+        only bounded by --read-timeout per read.)
+        Default: None
+        Required: False\n
+        ''')
+    )
+
+    parser.add_argument('--url-budget', '-ub',
+        action='store',
+        type=float,
+        help=textwrap.dedent('''
+        Max seconds spent on all methods of one URL. Timeouts are shortened to
+        fit, and methods left when it runs out are skipped.
+        Default: None
+        Required: False\n
+        ''')
+    )
+
+    parser.add_argument('--concurrent', '-c',
+        action='store_true',
+        help=textwrap.dedent('''
+        Send all request methods for a URL at the same time instead of one
+        after another. A URL then takes about as long as its slowest method.
+        Default: False
+        Required: False\n
+        ''')
+    )
+
+    parser.add_argument('--workers', '-w',
+        action='store',
+        type=int,
+        help=textwrap.dedent('''
+        Number of URLs to scan at the same time. Results keep input order.
+        Default: 1
+        Required: False\n
+        ''')
+    )
+
+    parser.add_argument('--host-limit', '-hl',
+        action='store',
+        type=int,
+        default=2,
+        help=textwrap.dedent('''
+        Max URLs of the same host scanned at the same time when using
+        --workers or the async engine. (Use '0' to remove limit)
+        Default: 2
+        Required: False\n
+        ''')
+    )
 
-        # HTTP: OPTIONS
-        if 'OPTIONS' not in except_:
-            options_scan_result = self.try_options(
-                url,
-                headers = self.use_headers,
-                proxy = self.use_proxy,
-                data = self.use_data,
-                timeout = self.use_timeout )
-            scan_results['OPTIONS'] = options_scan_result
-
-        # HTTP: PATCH
-        if 'PATCH' not in except_:
-            patch_scan_result = self.try_patch(
-                url,
-                headers = self.use_headers,
-                proxy = self.use_proxy,
-                data = self.use_data,
-                timeout = self.use_timeout )
-            scan_results['PATCH'] = patch_scan_result
+    parser.add_argument('--stream-content', '-S',
+        action='store_true',
+        help=textwrap.dedent('''
+        Stream response bodies and stop reading at --shrink-content bytes
+        instead of downloading whole bodies first. Sizes come from
+        Content-Length, or are counted up to --drain-limit extra bytes.
+        Default: False
+        Required: False\n
+        ''')
+    )
 
-        end = time.time()
-        duration: float = round(end - begin, 3)
-        
-        return scan_results, duration
+    parser.add_argument('--drain-limit', '-dl',
+        action='store',
+        type=int,
+        help=textwrap.dedent('''
+        With --stream-content, max bytes read past the kept content to measure
+        a body's size (or to keep the connection reusable). Bigger bodies are
+        cut off and their size is a lower bound.
+        Default: 1048576
+        Required: False\n
+        ''')
+    )
 
-# MAIN
-def main(args: list):
-    urls = []
-    except_=[]
-    output = None
-    output_format = None
-    max_content_size = -1
-    c = Color()
-    recon = EndpointRecon()
+    parser.add_argument('--adaptive-methods', '-am',
+        action='store_true',
+        help=textwrap.dedent('''
+        Send OPTIONS first and skip methods missing from its Allow header.
+        Also skip methods that were refused (405/501) on enough earlier URLs
+        of the same path pattern or host; one in 50 of those is sent anyway in
+        case the server has started accepting it. Skipped methods are
+        recorded with the reason as the error.
+        Default: False
+        Required: False\n
+        ''')
+    )
 
-    
-    print(logo)
+    parser.add_argument('--adaptive-evidence',
+        action='store',
+        type=int,
+        default=3,
+        help=textwrap.dedent('''
+        Refusals of a method on URLs of one path pattern before it is skipped
+        there with --adaptive-methods (three times as many for a whole host)
+        Default: 3
+        Required: False\n
+        ''')
+    )
 
-    # Select URL from args
-    if args.url != None:
-        urls.append(args.url)
-    # Or a file of URLs
-    elif args.url_file != None:
-        lines = []
-        try:
-            with open(str(args.url_file), 'r', encoding='utf8', errors='ignore') as f:
-                lines = f.readlines()
-        except Exception as err:
-            print("{}Error while reading from URL file: \'{}\'{}".format(c.red,args.url_file,c.reset))
-            print(err)
-            return -1
-        
-        [urls.append(url.strip()) for url in lines if url not in ['', ' ', '\n'] and url.startswith('http')]
-    # But its required :c
-    else:
-        print('Error: URL is required.')
-        print('Use \'--help\' or \'-h\' to see the help menu.')
-        return -1
-    
-    # Select Proxy from args
-    if args.proxy != None:
-        recon.use_proxy = {
-            'http': str(args.proxy),
-            'https': str(args.proxy)}
-        
-    # Select method exceptions
-    if args.exclude != None:
-        except_ = [e.strip().upper() for e in str(args.exclude).split(',')]
-    
-    if args.timeout != None:
-        recon.use_timeout = int(args.timeout)
-    
-    if args.output != None:
-        output = args.output
+    parser.add_argument('--rate', '-rl',
+        action='store',
+        type=float,
+        help=textwrap.dedent('''
+        Max requests per second sent to each host. Halved while a host answers
+        429/503, recovered gradually after. Enables --backoff.
+        Default: None (unlimited)
+        Required: False\n
+        ''')
+    )
 
-        if args.output_format != None:
-            output_format = args.output_format
-        else:
-            output_format = 'json'
-    
-    if args.shrink_content != None:
-        if str(args.shrink_content).lower() == 'none':
-            max_content_size = -1
-        else:
-            max_content_size = int(args.shrink_content)
-    
+    parser.add_argument('--burst', '-rb',
+        action='store',
+        type=int,
+        help=textwrap.dedent('''
+        Requests a host may receive at once before --rate applies
+        Default: Same as --rate
+        Required: False\n
+        ''')
+    )
 
-    # Run analysis
-    results = []
-    for url in urls:
-        
-        res, duration = recon.begin(
-            url,
-            except_=except_ )
-        results.append((url,res))
+    parser.add_argument('--backoff', '-bo',
+        action='store_true',
+        help=textwrap.dedent('''
+        Pause a host after a 429/503 for its Retry-After (or an exponential
+        backoff) and retry the throttled probe up to --max-retries times.
+        Default: False
+        Required: False\n
+        ''')
+    )
 
-        if output == None and output_format == None:
-    
-            # Print result
-            print('{}URL:{} {}{}{}'.format(c.cyan,c.reset,c.yellow,url,c.reset))
-            print('{}Duration:{} {}{}{} seconds'.format(c.cyan,c.reset,c.yellow,str(duration),c.reset))
-            print(' \n')
+    parser.add_argument('--max-retries', '-mr',
+        action='store',
+        type=int,
+        default=2,
+        help=textwrap.dedent('''
+        Retries for a probe answered with 429/503 (with --rate or --backoff)
+        Default: 2
+        Required: False\n
+        ''')
+    )
 
-            for k in list(res.keys()):
-                
-                print(' {}Request Method:{} {}{}{}'.format(
-                    c.cyan, c.reset, c.green, k, c.reset ) )
+    parser.add_argument('--max-backoff', '-mb',
+        action='store',
+        type=float,
+        default=60.0,
+        help=textwrap.dedent('''
+        Longest pause in seconds a host is given after a 429/503
+        Default: 60
+        Required: False\n
+        ''')
+    )
 
-                print('  {}Request Completed:{} {}{}{}'.format(
-                    c.cyan, c.reset, c.yellow, res[k].request_success, c.reset ) )
-                
-                print('  {}Status:{} {}{}{} ({})'.format(
-                    c.cyan, c.reset, c.yellow, res[k].status_code, c.reset,
-                    STATUS_CODES[res[k].status_code] if res[k].status_code in list(STATUS_CODES.keys()) else 'Unknown' ) )
-                
-                print('  {}Response Content Type:{} {}{}{}'.format(
-                    c.cyan, c.reset, c.yellow, res[k].response_content_type, c.reset ) )
+    parser.add_argument('--pool-size', '-ps',
+        action='store',
+        type=int,
+        help=textwrap.dedent('''
+        Keep-alive connections kept open per host and reused across methods
+        and URLs.
+        Default: 10 (or enough for every method in flight with --concurrent)
+        Required: False\n
+        ''')
+    )
 
-                print('  {}Response Size:{} {}Approx. {}{}{} Bytes{}'.format(
-                    c.cyan, c.reset, c.white, c.yellow, res[k].response_size, c.white, c.reset ) )
+    parser.add_argument('--engine', '-e',
+        action='store',
+        type=str,
+        choices=['threads', 'async'],
+        default='threads',
+        help=textwrap.dedent('''
+        Scanning engine. 'threads' uses blocking requests on worker threads,
+        'async' keeps every probe on one asyncio event loop (requires aiohttp)
+        Default: threads
+        Required: False\n
+        ''')
+    )
 
-                print('  {}Content:{}{}\n'.format(
-                    c.cyan, c.reset,
-                    res[k].response_content[:max_content_size] or 'Not Available' ) )
-                
-                print(' \n')
+    parser.add_argument('--max-inflight', '-mi',
+        action='store',
+        type=int,
+        default=500,
+        help=textwrap.dedent('''
+        Max requests open at the same time with the async engine
+        Default: 500
+        Required: False\n
+        ''')
+    )
 
-                if res[k].error != None:
-                    print('Error: {}{}{}'.format(c.red,res[k].error,c.reset))
-    
-    if output != None and output_format != None:
-        print("Results saved to {} as select format: \'{}\'.".format(output,output_format.upper()))
-        export_output(results,output,output_format,max_content_size)
-        
+    parser.add_argument('--dns-cache', '-dc',
+        action='store_true',
+        help=textwrap.dedent('''
+        Cache DNS answers in-process for --dns-ttl seconds instead of looking
+        hosts up again for every request.
+        Default: False
+        Required: False\n
+        ''')
+    )
 
-if __name__ == "__main__":
-    requests.packages.urllib3.disable_warnings()
-    
-    parser = argparse.ArgumentParser(
-        prog='URL Spy',
-        formatter_class=argparse.RawTextHelpFormatter,
-        description=textwrap.dedent(f'''
+    parser.add_argument('--dns-ttl',
+        action='store',
+        type=float,
+        default=300.0,
+        help=textwrap.dedent('''
+        Seconds a cached DNS answer is used
+        Default: 300
+        Required: False\n
+        ''')
+    )
 
-                       {logo}
-                Quickly check the availability of mulitple HTTP request methods of a URL
-                and discover necessary information for further analysis.
-            
-        '''),
-        epilog=textwrap.dedent('''\
-            Find on GitHub: https://github.com/CyberJosie/URLs.py
+    parser.add_argument('--resolve-first', '-rf',
+        action='store_true',
+        help=textwrap.dedent('''
+        Resolve every host in parallel before scanning and skip all URLs of
+        hosts that do not resolve. Enables --dns-cache. Ignored with --proxy.
+        Default: False
+        Required: False\n
         ''')
     )
 
-    parser.add_argument('--url', '-u',
+    parser.add_argument('--dns-workers',
         action='store',
-        type=str,
+        type=int,
+        default=32,
         help=textwrap.dedent('''
-        URL (host and endpoint together) to investigate.
-        Default: None
-        Required: True\n
+        Parallel lookups for --resolve-first
+        Default: 32
+        Required: False\n
         ''')
     )
 
-    parser.add_argument('--url-file', '-uf',
+    parser.add_argument('--precheck', '-pc',
         action='store',
         type=str,
+        choices=['tcp', 'head'],
         help=textwrap.dedent('''
-        Path to file of URLs to analyze. (URLs are newline separated).
+        Check each host once before probing it, with a TCP connect or a single
+        HEAD request. Hosts that fail get every method skipped with the reason
+        as the error. 'tcp' falls back to 'head' behind a proxy.
         Default: None
-        Required: True (If a single URL is not given)\n
+        Required: False\n
         ''')
     )
 
-    parser.add_argument('--timeout', '-t',
+    parser.add_argument('--precheck-timeout', '-pt',
         action='store',
-        type=int,
+        type=float,
+        default=3.0,
         help=textwrap.dedent('''
-        Max seconds to wait for each server response
-        Default: 10
+        Seconds to wait for the --precheck
+        Default: 3
         Required: False\n
-        ''')        
+        ''')
     )
 
     parser.add_argument('--exclude', '-ex',
@@ -693,6 +4241,99 @@ if __name__ == "__main__":
         ''')
     )
 
+    parser.add_argument('--proxy-pool', '-pp',
+        action='store',
+        type=str,
+        help=textwrap.dedent('''
+        Comma separated proxies, or a file with one per line, to spread
+        requests over. A proxy that keeps failing while the others work is
+        ejected for a while. Used instead of --proxy.
+        Default: None
+        Required: False\n
+        ''')
+    )
+
+    parser.add_argument('--proxy-strategy',
+        action='store',
+        type=str,
+        choices=ProxyPool.strategies,
+        default='round-robin',
+        help=textwrap.dedent('''
+        How requests are spread over --proxy-pool: in turn, or to the proxy
+        with the lowest average latency for its current load
+        Default: round-robin
+        Required: False\n
+        ''')
+    )
+
+    parser.add_argument('--proxy-max-failures',
+        action='store',
+        type=int,
+        default=3,
+        help=textwrap.dedent('''
+        Failures in a row before a proxy of --proxy-pool is ejected
+        Default: 3
+        Required: False\n
+        ''')
+    )
+
+    parser.add_argument('--proxy-eject',
+        action='store',
+        type=float,
+        default=30,
+        help=textwrap.dedent('''
+        Seconds an ejected proxy is left out, doubled for each ejection in a
+        row (at most 600)
+        Default: 30
+        Required: False\n
+        ''')
+    )
+
+    parser.add_argument('--resume', '-r',
+        action='store',
+        type=str,
+        help=textwrap.dedent('''
+        Path to a scan journal. Every finished URL and its methods are appended to
+        it, and URLs it already lists are skipped, so an interrupted scan can
+        be restarted with the same command. Output files are appended to.
+        Default: None
+        Required: False\n
+        ''')
+    )
+
+    parser.add_argument('--progress', '-P',
+        action='store_true',
+        help=textwrap.dedent('''
+        Show a live progress line on STDERR: URLs done/total, requests/sec,
+        error rate and ETA. (A new line every 10 seconds when STDERR is not a
+        terminal.)
+        Default: False
+        Required: False\n
+        ''')
+    )
+
+    parser.add_argument('--metrics-port', '-mp',
+        action='store',
+        type=int,
+        help=textwrap.dedent('''
+        Serve live scan metrics over HTTP on this port: /metrics in the
+        Prometheus text format, /metrics.json as JSON. (Use '0' for any free port)
+        Default: None
+        Required: False\n
+        ''')
+    )
+
+    parser.add_argument('--metrics-host',
+        action='store',
+        type=str,
+        default='127.0.0.1',
+        help=textwrap.dedent('''
+        Address the metrics endpoint listens on
+        Default: 127.0.0.1
+        Required: False\n
+        ''')
+    )
+
     parser.add_argument('--output', '-o',
         action='store',
         type=str,
@@ -707,12 +4348,36 @@ if __name__ == "__main__":
         action='store',
         type=str,
         help=textwrap.dedent('''
-        Formatting to export output as. Options: JSON, CSV, greppable
+        Formatting to export output as. Options: JSON, JSONL, CSV, SQLite, greppable
+        Rows are written as each URL finishes (SQLite: in batches, into an
+        indexed 'results' table that can be queried during the scan).
         Default: JSON (If only output flag is given, else there is no default)
         Required: False\n
         ''')
     )
 
+    parser.add_argument('--body-table', '-bt',
+        action='store',
+        type=str,
+        help=textwrap.dedent('''
+        Write each distinct response body once to this file (JSON Lines, keyed
+        by Response-Hash) and leave bodies out of the --output rows, which
+        reference them by hash.
+        Default: None
+        Required: False\n
+        ''')
+    )
+
+    parser.add_argument('--table', '-T',
+        action='store_true',
+        help=textwrap.dedent('''
+        Print one line per URL with the status code of each method instead of
+        the full results. (Only when no output file is given)
+        Default: False
+        Required: False\n
+        ''')
+    )
+
     parser.add_argument('--shrink-content', '-K',
         action='store',
         type=int,
@@ -726,5 +4391,11 @@ if __name__ == "__main__":
     )
 
 
-    args = parser.parse_args()
+    return parser
+
+
+if __name__ == "__main__":
+    requests.packages.urllib3.disable_warnings()
+
+    args = build_parser().parse_args()
     main(args)
@@ -0,0 +1,528 @@
+import argparse
+import asyncio
+import contextlib
+import gc
+import io
+import json
+import multiprocessing
+import os
+import random
+import resource
+import shlex
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import requests
+
+import URLs
+
+
+# Minimal HTTP/1.1 server on the loopback interface so the scanner can be
+# measured without touching the network. Every method is answered after
+# `latency` seconds (plus up to `jitter` more) with a body of `body_size`
+# bytes, or a random size up to `body_size_max`. A share of requests
+# (`error_rate`) gets a 500, another (`reset_rate`) has its connection dropped
+# without an answer. Each of the `hosts` synthetic hosts is its own loopback
+# address (127.0.0.1, 127.0.0.2, ...) so per-host limits behave like they do
+# on real targets. Runs on a thread, or in a child process so it does not
+# share the scanner's CPU and memory figures.
+class MockServer:
+    def __init__(self, port=0, hosts=1, latency=0.0, jitter=0.0, body_size=64,
+                 body_size_max=None, error_rate=0.0, reset_rate=0.0, seed=None):
+        self.port = port
+        self.hosts = ['127.0.0.{}'.format(i + 1) for i in range(max(1, hosts))]
+        self.latency = latency
+        self.jitter = jitter
+        self.body_size = body_size
+        self.body_size_max = max(body_size, body_size_max or body_size)
+        self.error_rate = error_rate
+        self.reset_rate = reset_rate
+        self.seed = seed
+        self._served = multiprocessing.Value('q', 0)
+        self._loop = None
+        self._servers = []
+        self._handlers = {}
+        self._stopping = None
+        self._ready = threading.Event()
+        self._thread = None
+        self._process = None
+
+    @property
+    def requests_served(self):
+        return self._served.value
+
+    async def _handle(self, reader, writer):
+        task = asyncio.current_task()
+        self._handlers[task] = writer
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method = request_line.split(b' ', 1)[0].upper()
+
+                content_length = 0
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.partition(b':')
+                    if name.strip().lower() == b'content-length':
+                        content_length = int(value.strip() or 0)
+                if content_length:
+                    await reader.readexactly(content_length)
+
+                delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+                with self._served.get_lock():
+                    self._served.value += 1
+
+                roll = self._random.random()
+                if roll < self.reset_rate:
+                    writer.transport.abort()
+                    break
+
+                status = '200 OK'
+                if roll < self.reset_rate + self.error_rate:
+                    status = '500 Internal Server Error'
+                size = self.body_size
+                if self.body_size_max > self.body_size:
+                    size = self._random.randint(self.body_size, self.body_size_max)
+
+                head = 'HTTP/1.1 {}\r\nContent-Type: text/plain\r\nContent-Length: {}\r\n\r\n'.format(status, size)
+                writer.write(head.encode())
+                if method != b'HEAD' and size:
+                    writer.write(self._body[:size])
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._handlers.pop(task, None)
+            writer.close()
+
+    async def _serve(self, on_ready):
+        self._random = random.Random(self.seed)
+        self._body = memoryview(b'x' * self.body_size_max)
+
+        # Bind the first address to pick a free port, then the rest to the same one
+        for host in self.hosts:
+            server = await asyncio.start_server(
+                self._handle, host=host, port=self.port, backlog=4096)
+            self.port = server.sockets[0].getsockname()[1]
+            self._servers.append(server)
+        self._stopping = asyncio.Event()
+        on_ready(self.port)
+        await self._stopping.wait()
+
+        for server in self._servers:
+            server.close()
+        # Close keep-alive connections that are still open; their handlers
+        # see the end of the stream and return
+        handlers = list(self._handlers.items())
+        for task, writer in handlers:
+            writer.close()
+        await asyncio.gather(*[task for task, writer in handlers], return_exceptions=True)
+
+    def start(self, process=False):
+        if process:
+            ports = multiprocessing.Queue()
+            self._process = multiprocessing.Process(
+                target=self._run_process, args=(ports,), name='mock-server', daemon=True)
+            self._process.start()
+            self.port = ports.get()
+            return self
+
+        def on_ready(port):
+            self._ready.set()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            try:
+                self._loop.run_until_complete(self._serve(on_ready))
+            finally:
+                self._loop.close()
+
+        self._thread = threading.Thread(target=run, name='mock-server', daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        return self
+
+    def _run_process(self, ports):
+        asyncio.run(self._serve(ports.put))
+
+    def stop(self):
+        if self._process != None:
+            self._process.terminate()
+            self._process.join()
+            self._process = None
+        elif self._stopping != None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._stopping.set)
+            self._thread.join()
+
+    def urls(self, count):
+        for i in range(count):
+            host = self.hosts[i % len(self.hosts)]
+            yield 'http://{}:{}/item/{}'.format(host, self.port, i)
+
+
+# Value at quantile `q` (0..1) of an already sorted list
+def percentile(values, q):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        rss /= 1024
+    return round(rss / 1024, 1)
+
+
+# Record how long every request takes by wrapping the engine's send call. The
+# phases an engine times add up to the request from the moment it has a slot,
+# so time spent queueing for the async engine's in-flight limit is left out.
+def time_requests(recon, samples):
+    def record(sent):
+        result = sent[0]
+        if result.timings != None:
+            samples.append(sum(t for t in result.timings if t != None))
+
+    if isinstance(recon, URLs.AsyncEndpointRecon):
+        send_async = recon._send_async
+
+        async def timed_async(*args, **kwargs):
+            sent = await send_async(*args, **kwargs)
+            record(sent)
+            return sent
+
+        recon._send_async = timed_async
+    else:
+        send = recon._send
+
+        def timed(*args, **kwargs):
+            sent = send(*args, **kwargs)
+            record(sent)
+            return sent
+
+        recon._send = timed
+
+
+# Scan `count` synthetic URLs through EndpointRecon.begin (via scan_urls) and
+# report throughput and latency
+def run_begin(recon, server, count, except_=[], workers=1, per_host=0):
+    request_times = []
+    time_requests(recon, request_times)
+    url_times = []
+
+    served_before = server.requests_served
+    begin = time.time()
+    failed = 0
+    for index, url, res, duration in URLs.scan_urls(
+            recon,
+            server.urls(count),
+            except_=except_,
+            workers=workers,
+            per_host=per_host ):
+        url_times.append(duration)
+        failed += sum(1 for r in res.values() if not r.request_success or r.status_code >= 500)
+    elapsed = time.time() - begin
+    served = server.requests_served - served_before
+    sent, opened = recon.connection_stats()
+
+    request_times.sort()
+    url_times.sort()
+    return {
+        'urls': len(url_times),
+        'requests': served,
+        'failed': failed,
+        'connections_opened': opened,
+        'seconds': round(elapsed, 3),
+        'requests_per_second': round(served / elapsed, 1) if elapsed else 0,
+        'request_p50_ms': round(percentile(request_times, 0.50) * 1000, 2),
+        'request_p99_ms': round(percentile(request_times, 0.99) * 1000, 2),
+        'url_p50_ms': round(percentile(url_times, 0.50) * 1000, 2),
+        'url_p99_ms': round(percentile(url_times, 0.99) * 1000, 2),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+# Run the whole command line scan loop, URLs.main(), on a file of `count`
+# synthetic URLs with `scan_args` as extra options
+def run_main(server, count, scan_args=[]):
+    with tempfile.TemporaryDirectory() as tmp:
+        url_file = os.path.join(tmp, 'urls.txt')
+        with open(url_file, 'w') as f:
+            for url in server.urls(count):
+                f.write(url + '\n')
+        output = os.path.join(tmp, 'out.jsonl')
+
+        args = URLs.build_parser().parse_args(
+            ['--url-file', url_file, '--output', output, '--output-format', 'jsonl'] + list(scan_args))
+
+        served_before = server.requests_served
+        begin = time.time()
+        with contextlib.redirect_stdout(io.StringIO()):
+            URLs.main(args)
+        elapsed = time.time() - begin
+        served = server.requests_served - served_before
+
+        rows = 0
+        failed = 0
+        with open(output) as f:
+            for line in f:
+                row = json.loads(line)
+                rows += 1
+                if not row['Request-Success'] or row['Status-Code'] >= 500:
+                    failed += 1
+
+    return {
+        'urls': count,
+        'rows': rows,
+        'requests': served,
+        'failed': failed,
+        'seconds': round(elapsed, 3),
+        'requests_per_second': round(served / elapsed, 1) if elapsed else 0,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+# EndpointResult as it was before it got __slots__: class-level defaults,
+# an instance __dict__ and the body decoded to str eagerly
+class LegacyEndpointResult:
+    response_content = None
+    request_success = False
+    response_content_type = "Not Specificed"
+    response_size = 0
+    status_code = 0
+    error = None
+
+
+def _legacy_result(body, content_type):
+    result = LegacyEndpointResult()
+    result.request_success = True
+    result.response_content = body.decode('utf8','ignore')
+    result.response_size = len(result.response_content)
+    result.status_code = 200
+    result.response_content_type = content_type
+    return result
+
+
+def _compact_result(body, content_type):
+    result = URLs.EndpointResult()
+    result.request_success = True
+    result.response_body = body
+    result.response_size = len(body)
+    result.status_code = 200
+    result.response_content_type = sys.intern(content_type)
+    result.body_hash = URLs.body_digest(body)
+    result.timings = (0.001, 0.002, None, 0.01, 0.0005)
+    return result
+
+
+# Bytes traced while holding `count` results built by `build`. Every result
+# gets its own body and content type string, as if read off the wire.
+def _traced_size(build, count, body_size):
+    gc.collect()
+    tracemalloc.start()
+    results = []
+    for i in range(count):
+        body = (b'%08d' % i) + b'x' * max(0, body_size - 8)
+        content_type = ''.join(['text/html; ', 'charset=utf-8'])
+        results.append(build(body, content_type))
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del results
+    gc.collect()
+    return size
+
+
+# Compare the memory held by `count` results in the old and current layout
+def measure_result_memory(count, body_size=64):
+    legacy = _traced_size(_legacy_result, count, body_size)
+    compact = _traced_size(_compact_result, count, body_size)
+    return {
+        'results': count,
+        'body_size': body_size,
+        'legacy_mb': round(legacy / 1024 / 1024, 1),
+        'compact_mb': round(compact / 1024 / 1024, 1),
+        'legacy_bytes_per_result': round(legacy / count, 1),
+        'compact_bytes_per_result': round(compact / count, 1),
+        'saved_percent': round(100 - compact * 100 / legacy, 1) if legacy else 0,
+    }
+
+
+# Results with the fields the writers format differently: content types
+# with parameters or none at all, empty bodies and failed requests
+def _sample_results():
+    results = {}
+    for method, status, content_type, body in (
+            ('GET', 200, 'text/html; charset=utf-8', b'<html>ok</html>'),
+            ('HEAD', 200, None, b''),
+            ('PUT', 405, 'application/problem+json; charset=utf-8; profile=x', b'{"error": 1}'),
+            ('POST', 0, None, None) ):
+        result = URLs.EndpointResult()
+        if body != None:
+            result.request_success = True
+            result.status_code = status
+            result.response_content_type = content_type
+            result.response_body = body
+            result.response_size = len(body)
+            result.body_hash = URLs.body_digest(body) if body else None
+            result.etag = '"v1"' if method == 'GET' else None
+            result.timings = (0.001, 0.002, None, 0.01, 0.0005)
+        else:
+            result.error = 'Connection refused'
+        results[method] = result
+    return results
+
+
+# Write results with every output writer, read them back and load them as a
+# baseline: none of them may show up as changed against themselves
+def check_output_roundtrip():
+    url = 'http://127.0.0.1/check?a=1&b=2'
+    results = _sample_results()
+    report = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for output_format in URLs.OUTPUT_WRITERS:
+            path = os.path.join(tmp, 'out.' + output_format)
+            writer = URLs.open_writer(path, output_format, -1)
+            writer.write(url, results)
+            writer.close()
+            baseline = URLs.Baseline()
+            baseline.load(path)
+            changes = {m: baseline.change(url, m, r) for m, r in results.items()}
+            report[output_format] = ', '.join(
+                '{}: {}'.format(m, change) for m, change in changes.items() if change != None) or 'ok'
+    return report
+
+
+def print_stats(title, stats):
+    print(title)
+    for k, v in stats.items():
+        print('  {}: {}'.format(k, v))
+
+
+def main(args):
+    if args.memory:
+        print_stats('EndpointResult memory', measure_result_memory(args.memory, args.body_size))
+        return
+
+    if args.check_output:
+        report = check_output_roundtrip()
+        print_stats('Output round trip (writer -> read_rows -> Baseline.change)', report)
+        return 0 if all(v == 'ok' for v in report.values()) else 1
+
+    server = MockServer(
+        hosts=args.hosts,
+        latency=args.latency,
+        jitter=args.jitter,
+        body_size=args.body_size,
+        body_size_max=args.body_size_max,
+        error_rate=args.error_rate,
+        reset_rate=args.reset_rate,
+        seed=args.seed ).start(process=not args.in_process)
+    print('Mock server on {} port {}'.format(','.join(server.hosts), server.port))
+
+    report = {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'params': {k: v for k, v in vars(args).items() if k not in ('json',)},
+    }
+    try:
+        if args.mode in ('begin', 'both'):
+            if args.engine == 'async':
+                recon = URLs.AsyncEndpointRecon()
+                recon.max_inflight = args.max_inflight
+            else:
+                recon = URLs.EndpointRecon()
+                recon.concurrent = args.concurrent
+                recon.method_workers = max(1, args.workers) * len(URLs.METHODS)
+                if args.concurrent:
+                    recon.pool_size = max(recon.pool_size, max(1, args.host_limit) * len(URLs.METHODS))
+
+            report['begin'] = run_begin(
+                recon,
+                server,
+                args.count,
+                workers=args.workers,
+                per_host=args.host_limit )
+            recon.close()
+            print_stats('EndpointRecon.begin ({} engine)'.format(args.engine), report['begin'])
+
+        if args.mode in ('main', 'both'):
+            scan_args = ['--engine', args.engine, '--host-limit', str(args.host_limit)]
+            if args.engine == 'async':
+                scan_args += ['--max-inflight', str(args.max_inflight)]
+            else:
+                scan_args += ['--workers', str(args.workers)]
+                if args.concurrent:
+                    scan_args.append('--concurrent')
+            scan_args += shlex.split(args.scan_args)
+
+            report['main'] = run_main(server, args.count, scan_args)
+            print_stats('main() scan loop ({})'.format(' '.join(scan_args)), report['main'])
+    finally:
+        server.stop()
+
+    # Append to a results file so runs can be compared over time
+    if args.json != None:
+        with open(args.json, 'a') as f:
+            f.write(json.dumps(report) + '\n')
+
+
+if __name__ == "__main__":
+    requests.packages.urllib3.disable_warnings()
+
+    parser = argparse.ArgumentParser(
+        prog='URL Spy Bench',
+        formatter_class=argparse.RawTextHelpFormatter,
+        description='Measure scanner throughput, latency and memory against a local mock HTTP server.')
+
+    parser.add_argument('--mode', choices=['begin', 'main', 'both'], default='both',
+        help='Measure EndpointRecon.begin, the main() scan loop, or both. Default: both')
+    parser.add_argument('--count', '-n', type=int, default=1000,
+        help='Number of synthetic URLs to scan. Default: 1000')
+    parser.add_argument('--hosts', type=int, default=4,
+        help='Number of synthetic hosts (loopback addresses). Default: 4')
+    parser.add_argument('--latency', type=float, default=0.0,
+        help='Seconds the server waits before each response. Default: 0')
+    parser.add_argument('--jitter', type=float, default=0.0,
+        help='Up to this many extra random seconds per response. Default: 0')
+    parser.add_argument('--body-size', type=int, default=64,
+        help='Response body size in bytes. Default: 64')
+    parser.add_argument('--body-size-max', type=int, default=None,
+        help='Pick body sizes at random between --body-size and this. Default: None')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+        help='Share of requests answered with a 500 (0..1). Default: 0')
+    parser.add_argument('--reset-rate', type=float, default=0.0,
+        help='Share of requests whose connection is dropped (0..1). Default: 0')
+    parser.add_argument('--seed', type=int, default=None,
+        help='Random seed for the server. Default: None')
+    parser.add_argument('--in-process', action='store_true',
+        help='Run the server on a thread of this process instead of a child process')
+    parser.add_argument('--engine', '-e', choices=['threads', 'async'], default='threads',
+        help='Scanning engine to measure. Default: threads')
+    parser.add_argument('--concurrent', '-c', action='store_true',
+        help='Probe all methods of a URL at once (threads engine)')
+    parser.add_argument('--workers', '-w', type=int, default=1,
+        help='URLs scanned at the same time (threads engine). Default: 1')
+    parser.add_argument('--host-limit', '-hl', type=int, default=0,
+        help='Max URLs of the same host in flight. Default: 0 (no limit)')
+    parser.add_argument('--max-inflight', '-mi', type=int, default=500,
+        help='Max requests open at once (async engine). Default: 500')
+    parser.add_argument('--scan-args', type=str, default='',
+        help='Extra URLs.py options for the main() run, e.g. "--stream-content -K 100"')
+    parser.add_argument('--json', type=str, default=None,
+        help='Append the report as one JSON line to this file')
+    parser.add_argument('--memory', type=int, default=0,
+        help='Instead of scanning, measure the memory of this many results in the\nold and current EndpointResult layout (e.g. 1000000)')
+    parser.add_argument('--check-output', action='store_true',
+        help='Instead of scanning, check that results written in every output format\nread back unchanged as a --baseline')
+
+    sys.exit(main(parser.parse_args()))